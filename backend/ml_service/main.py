@@ -1,20 +1,44 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
 import numpy as np
 import uvicorn
+import asyncio
+import hmac
 import os
+from concurrent.futures.process import BrokenProcessPool
 
-from services.face_detection import (
-    base64_to_image,
-    detect_face,
-    extract_face_region,
-    preprocess_face,
-    calculate_image_quality
-)
-from services.liveness_detection import check_liveness_advanced as check_liveness
+from services.face_detection import base64_to_image
+from services import pipeline
+from services.process_pool import INFERENCE_MODE
 from models.face_recognition import get_model
+from services.gallery import get_gallery
+from services.model_registry import get_registry, MODEL_REAPER_INTERVAL_SECONDS
+from services.batch_jobs import get_job_manager, get_priority_gate
+from services.admission import ADMISSION_MAX_IN_FLIGHT, get_admission, priority_rank, deadline_from_timeout
+from services.timing import ServerTimingMiddleware, get_profiler, stage
+from services.execution_plan import EXECUTION_PLAN, autotune, get_execution_plan
+from services.liveness_detection import get_liveness_batcher
+
+# Service mode: "shard" (default) keeps a local gallery; "coordinator" fans
+# gallery operations out to the instances listed in ML_SHARD_URLS.
+SERVICE_MODE = os.environ.get("ML_SERVICE_MODE", "shard")
+SHARD_URLS = [u.strip() for u in os.environ.get("ML_SHARD_URLS", "").split(",") if u.strip()]
+SHARD_TIMEOUT_SECONDS = float(os.environ.get("SHARD_TIMEOUT_SECONDS", "0.5"))
+# Per fetch/import/evict call while adding or draining a shard
+SHARD_REBALANCE_TIMEOUT_SECONDS = float(os.environ.get("SHARD_REBALANCE_TIMEOUT_SECONDS", "60"))
+# Extra shard URLs that POST /shards may add (the ML_SHARD_URLS are always allowed)
+SHARD_ALLOWLIST = [u.strip() for u in os.environ.get("ML_SHARD_ALLOWLIST", "").split(",") if u.strip()]
+
+# Shared secret for /admin, /shards and the bulk /gallery endpoints (sent as
+# X-Admin-Token); unset disables them
+ADMIN_TOKEN = os.environ.get("ML_ADMIN_TOKEN", "")
+
+_coordinator = None
+_process_pool = None
 
 app = FastAPI(
     title="FaceSecure ML Service",
@@ -31,9 +55,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-stage durations (decode, detect, crop, ...) on every response
+app.add_middleware(ServerTimingMiddleware)
+
 # Request/Response models
 class FaceDetectionRequest(BaseModel):
     image: str  # base64 encoded
+    priority: Optional[str] = None  # admission class, e.g. 'login'
+    timeoutMs: Optional[float] = None  # drop the request if it cannot start in time
 
 class FaceDetectionResponse(BaseModel):
     faceDetected: bool
@@ -43,9 +72,13 @@ class FaceDetectionResponse(BaseModel):
 class LivenessVerificationRequest(BaseModel):
     image: str
     sessionId: Optional[str] = "default"
+    priority: Optional[str] = None
+    timeoutMs: Optional[float] = None
 
 class EmbeddingRequest(BaseModel):
     image: str  # base64 encoded
+    priority: Optional[str] = None
+    timeoutMs: Optional[float] = None
 
 class EmbeddingResponse(BaseModel):
     embedding: List[float]
@@ -60,14 +93,88 @@ class CompareEmbeddingsResponse(BaseModel):
     match: bool
     confidence: str  # 'high', 'medium', 'low'
 
+class GalleryEntry(BaseModel):
+    userId: str
+    embedding: List[float]
+
+class GalleryImportRequest(BaseModel):
+    entries: List[GalleryEntry]
+
+class GalleryEvictRequest(BaseModel):
+    userIds: List[str]
+
+class IdentifyRequest(BaseModel):
+    embedding: List[float]
+    topK: int = 5
+
+class IdentifyResponse(BaseModel):
+    matches: List[dict]
+    partial: bool = False
+    failedShards: List[str] = []
+
+class ShardRequest(BaseModel):
+    url: str
+
+class BatchJobImage(BaseModel):
+    id: str
+    image: str  # base64 encoded
+    embedding: Optional[List[float]] = None  # reference for 'verify'
+
+class BatchJobRequest(BaseModel):
+    operation: str = "embed"  # 'embed', 'enroll' or 'verify'
+    images: Optional[List[BatchJobImage]] = None
+    directory: Optional[str] = None  # relative to BATCH_JOB_INPUT_ROOT
+    archive: Optional[str] = None  # .zip or .tar(.gz), relative to BATCH_JOB_INPUT_ROOT
+
+async def _model_reaper():
+    """Periodically unload idle models and keep RSS within budget"""
+    registry = get_registry()
+    while True:
+        await asyncio.sleep(MODEL_REAPER_INTERVAL_SECONDS)
+        # gc, malloc_trim and native close() calls must not block requests
+        await run_in_threadpool(registry.evict_idle)
+        await run_in_threadpool(registry.enforce_budget)
+
 # Initialize model on startup (lightweight — actual model loads lazily on first request)
 @app.on_event("startup")
 async def startup_event():
     """Startup event — models load lazily on first request to save memory"""
+    global _coordinator, _process_pool
     print("🚀 Starting FaceSecure ML Service...")
+    if EXECUTION_PLAN == "tune":
+        # Before the process pool and admission limits are sized from the plan
+        await run_in_threadpool(autotune)
+    else:
+        plan = get_execution_plan()
+        print(f"🧭 Execution plan ({plan.strategy}): {plan.workers} workers x {plan.threads} threads on {plan.cpus} CPUs")
+    if INFERENCE_MODE == "process":
+        from services.process_pool import InferenceProcessPool
+        _process_pool = InferenceProcessPool()
+        # Every worker process runs every model, so all tasks share one queue
+        # sized to the pool; per-model queues would admit a multiple of it and
+        # the excess would wait on the ring and executor with no deadline
+        get_admission().share("process_pool", ADMISSION_MAX_IN_FLIGHT or _process_pool.workers)
+    if SERVICE_MODE == "coordinator":
+        from services.sharding import ShardCoordinator
+        _coordinator = ShardCoordinator(
+            SHARD_URLS, timeout=SHARD_TIMEOUT_SECONDS, allowlist=SHARD_ALLOWLIST, admin_token=ADMIN_TOKEN,
+            rebalance_timeout=SHARD_REBALANCE_TIMEOUT_SECONDS,
+        )
+        get_job_manager().use_coordinator(_coordinator, asyncio.get_running_loop())
+        print(f"🔀 Coordinator mode: {len(SHARD_URLS)} shard(s)")
     print("✅ ML Service ready! (Models will load on first request)")
     import gc
     gc.collect()
+    asyncio.create_task(_model_reaper())
+    get_job_manager().resume_pending()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if _coordinator is not None:
+        await _coordinator.close()
+    if _process_pool is not None:
+        _process_pool.shutdown()
+    get_job_manager().shutdown()
 
 @app.get("/")
 async def root():
@@ -78,102 +185,114 @@ async def root():
         "version": "1.0.0"
     }
 
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Model residency, RSS and reload latency"""
+    metrics = {
+        "registry": get_registry().metrics(),
+        "admission": get_admission().metrics(),
+        "execution": get_execution_plan().metrics(),
+        "livenessBatching": get_liveness_batcher().metrics(),
+    }
+    if _process_pool is not None:
+        metrics["processPool"] = _process_pool.metrics()
+    return metrics
+
+def _require_admin(token: Optional[str]):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not token or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+def _admission_params(http_request: Request, body) -> tuple:
+    """
+    (priority rank, deadline) for a request
+
+    X-Request-Priority / X-Request-Timeout-Ms headers win over the body's
+    priority / timeoutMs fields. The timeout is relative so caller and
+    service clocks never need to agree.
+    """
+    try:
+        rank = priority_rank(http_request.headers.get("x-request-priority") or body.priority)
+        timeout_ms = http_request.headers.get("x-request-timeout-ms") or body.timeoutMs
+        return rank, deadline_from_timeout(float(timeout_ms) if timeout_ms else None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _decode(image_base64: str) -> np.ndarray:
+    with stage("decode"):
+        return base64_to_image(image_base64)
+
+async def _run_pipeline(task: str, image_base64: str, *args, rank: int, deadline: Optional[float]) -> dict:
+    """Decode the image and run a services/pipeline.py task off the event loop (thread or worker process)"""
+    # Wait for the model's admission slot; expired or hopeless work is rejected
+    # before it is even decoded, so shedding stays cheap under saturation
+    admission = get_admission().for_task(task)
+    async with admission.slot(rank, deadline):
+        # Interactive requests pause batch jobs while they are in flight
+        with get_priority_gate().interactive():
+            image = await run_in_threadpool(_decode, image_base64)
+            # Decoding a large upload can use up the rest of the budget
+            admission.check_deadline(deadline)
+            profiler = get_profiler()
+            # Profiled samples always run in-process so cProfile can see them
+            if _process_pool is not None and _process_pool.fits(image) and not profiler.wants_sample():
+                try:
+                    return await _process_pool.run(task, image, *args)
+                except BrokenProcessPool:
+                    # A worker died mid-task; the pool has been rebuilt, serve this one in-process
+                    pass
+            return await run_in_threadpool(profiler.run, getattr(pipeline, task), image, *args)
+
 @app.post("/detect-face", response_model=FaceDetectionResponse)
-async def detect_face_endpoint(request: FaceDetectionRequest):
+async def detect_face_endpoint(request: FaceDetectionRequest, http_request: Request):
     """
     Detect face in image
     
     Step 12: Face Detection & Preprocessing
     """
+    rank, deadline = _admission_params(http_request, request)
     try:
-        # Convert base64 to image
-        image = base64_to_image(request.image)
+        # Decode and detect face
+        result = await _run_pipeline("detect", request.image, rank=rank, deadline=deadline)
         
-        # Detect face
-        face_detected, confidence, bbox = detect_face(image)
-        
-        return FaceDetectionResponse(
-            faceDetected=face_detected,
-            confidence=confidence,
-            boundingBox=bbox
-        )
+        return FaceDetectionResponse(**result)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/generate-embedding", response_model=EmbeddingResponse)
-async def generate_embedding_endpoint(request: EmbeddingRequest):
+async def generate_embedding_endpoint(request: EmbeddingRequest, http_request: Request):
     """
     Generate face embedding from image
     
     Step 13: Generate Face Embeddings
     """
+    rank, deadline = _admission_params(http_request, request)
     try:
-        # Convert base64 to image
-        image = base64_to_image(request.image)
-        
-        # Detect face
-        face_detected, confidence, bbox = detect_face(image)
+        # Decode, detect, quality-gate, preprocess and embed
+        result = await _run_pipeline("embed", request.image, rank=rank, deadline=deadline)
         
-        if not face_detected or confidence < 0.5:
-            raise HTTPException(
-                status_code=400,
-                detail="No face detected or confidence too low"
-            )
-        
-        # Extract face region
-        face_region = extract_face_region(image, bbox)
-        
-        # Preprocess
-        face_preprocessed = preprocess_face(face_region)
-        
-        # Calculate quality
-        quality = calculate_image_quality(face_region)
-        
-        # Generate embedding
-        model = get_model()
-        embedding = model.generate_embedding(face_preprocessed)
-        
-        return EmbeddingResponse(
-            embedding=embedding.tolist(),
-            quality=quality
-        )
+        return EmbeddingResponse(**result)
+    except pipeline.PipelineError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/verify-liveness")
-async def verify_liveness_endpoint(request: LivenessVerificationRequest):
+async def verify_liveness_endpoint(request: LivenessVerificationRequest, http_request: Request):
     """
     Verify if the person in the image is real
     """
+    rank, deadline = _admission_params(http_request, request)
     try:
-        # Convert base64 to image
-        image = base64_to_image(request.image)
-        
-        # Detect face first
-        face_detected, confidence, bbox = detect_face(image)
-        
-        if not face_detected:
-            return {
-                "faceDetected": False,
-                "isLive": False,
-                "score": 0.0
-            }
-        
-        # Extract face for liveness check
-        face_region = extract_face_region(image, bbox)
-        
-        # Check liveness
-        liveness_result = check_liveness(face_region, session_id=request.sessionId)
-        
-        return {
-            "faceDetected": True,
-            "isLive": liveness_result['isLive'],
-            "score": liveness_result['score'],
-            "lowLight": liveness_result['lowLight'],
-            "metrics": liveness_result['metrics']
-        }
+        # Decode, detect, quality-gate and run the anti-spoof models
+        return await _run_pipeline("liveness", request.image, request.sessionId, rank=rank, deadline=deadline)
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         print(f"❌ Error in verify_liveness: {str(e)}")
@@ -192,18 +311,11 @@ async def compare_embeddings_endpoint(request: CompareEmbeddingsRequest):
         embedding2 = np.array(request.embedding2)
         
         model = get_model()
-        similarity = model.compare_embeddings(embedding1, embedding2)
+        with stage("compare"):
+            similarity = model.compare_embeddings(embedding1, embedding2)
         
         # Determine match and confidence level
-        if similarity >= 0.85:
-            match = True
-            confidence = "high"
-        elif similarity >= 0.70:
-            match = True
-            confidence = "medium"
-        else:
-            match = False
-            confidence = "low"
+        match, confidence = pipeline.classify_similarity(similarity)
         
         return CompareEmbeddingsResponse(
             similarity=similarity,
@@ -213,6 +325,186 @@ async def compare_embeddings_endpoint(request: CompareEmbeddingsRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/gallery/enroll")
+async def gallery_enroll_endpoint(request: GalleryEntry, http_request: Request):
+    """
+    Enroll an embedding for identification (admin only)
+
+    Routed to the owning shard by consistent hashing in coordinator mode.
+    """
+    _require_admin(http_request.headers.get("x-admin-token"))
+    try:
+        if _coordinator is not None:
+            shard = await _coordinator.enroll(request.userId, request.embedding)
+            return {"userId": request.userId, "shard": shard}
+        get_gallery().add(request.userId, request.embedding)
+        return {"userId": request.userId}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/gallery/identify", response_model=IdentifyResponse)
+async def gallery_identify_endpoint(request: IdentifyRequest):
+    """
+    Find the top-k enrolled users closest to an embedding
+
+    In coordinator mode the query is scattered to every shard and the
+    per-shard top-k lists are merged; slow shards yield a partial result.
+    """
+    try:
+        if _coordinator is not None:
+            return IdentifyResponse(**await _coordinator.identify(request.embedding, request.topK))
+        matches = get_gallery().search(request.embedding, request.topK)
+        return IdentifyResponse(
+            matches=[{"userId": user_id, "similarity": score} for user_id, score in matches]
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.delete("/gallery/{user_id:path}")
+async def gallery_remove_endpoint(user_id: str, http_request: Request):
+    """Remove a user from the gallery (admin only)"""
+    _require_admin(http_request.headers.get("x-admin-token"))
+    if _coordinator is not None:
+        removed = await _coordinator.remove(user_id)
+    else:
+        removed = get_gallery().remove(user_id)
+    return {"userId": user_id, "removed": removed}
+
+@app.get("/gallery/entries")
+async def gallery_entries_endpoint(http_request: Request):
+    """Dump the local gallery (used by the coordinator when rebalancing; admin only)"""
+    _require_admin(http_request.headers.get("x-admin-token"))
+    return {
+        "entries": [
+            {"userId": user_id, "embedding": embedding.tolist()}
+            for user_id, embedding in get_gallery().entries()
+        ]
+    }
+
+@app.post("/gallery/import")
+async def gallery_import_endpoint(request: GalleryImportRequest, http_request: Request):
+    """Bulk-load entries into the local gallery (admin only)"""
+    _require_admin(http_request.headers.get("x-admin-token"))
+    gallery = get_gallery()
+    for entry in request.entries:
+        gallery.add(entry.userId, entry.embedding)
+    return {"imported": len(request.entries)}
+
+@app.post("/gallery/evict")
+async def gallery_evict_endpoint(request: GalleryEvictRequest, http_request: Request):
+    """Bulk-remove entries from the local gallery (admin only)"""
+    _require_admin(http_request.headers.get("x-admin-token"))
+    gallery = get_gallery()
+    removed = sum(1 for user_id in request.userIds if gallery.remove(user_id))
+    return {"removed": removed}
+
+@app.get("/shards")
+async def list_shards_endpoint(http_request: Request):
+    """List shard instances (coordinator mode only, admin only)"""
+    _require_admin(http_request.headers.get("x-admin-token"))
+    if _coordinator is None:
+        raise HTTPException(status_code=404, detail="Not running in coordinator mode")
+    return {"shards": _coordinator.shards}
+
+@app.post("/shards")
+async def add_shard_endpoint(request: ShardRequest, http_request: Request):
+    """Add an allowlisted shard and rebalance the entries it now owns (admin only)"""
+    _require_admin(http_request.headers.get("x-admin-token"))
+    if _coordinator is None:
+        raise HTTPException(status_code=404, detail="Not running in coordinator mode")
+    try:
+        moved = await _coordinator.add_shard(request.url)
+        return {"shards": _coordinator.shards, "moved": moved}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+@app.delete("/shards")
+async def remove_shard_endpoint(url: str, http_request: Request):
+    """Drain a shard into the rest of the ring and remove it (admin only)"""
+    _require_admin(http_request.headers.get("x-admin-token"))
+    if _coordinator is None:
+        raise HTTPException(status_code=404, detail="Not running in coordinator mode")
+    try:
+        moved = await _coordinator.remove_shard(url)
+        return {"shards": _coordinator.shards, "moved": moved}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+@app.post("/jobs", status_code=202)
+async def submit_job_endpoint(request: BatchJobRequest, http_request: Request):
+    """
+    Submit a bulk embed/enroll/verify job (admin only)
+
+    Images come inline (base64) or from a directory/archive on the service
+    host. Returns a job ID to poll; batch work yields to interactive requests.
+    In coordinator mode enrollments are routed to the owning shards.
+    """
+    _require_admin(http_request.headers.get("x-admin-token"))
+    try:
+        items = [item.dict(exclude_none=True) for item in request.images] if request.images is not None else None
+        job = await run_in_threadpool(
+            get_job_manager().submit, request.operation, items, request.directory, request.archive
+        )
+        return {"jobId": job["id"], "status": job["status"], "total": job["total"]}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/jobs/{job_id}")
+async def get_job_endpoint(job_id: str, http_request: Request):
+    """Job status and progress (admin only)"""
+    _require_admin(http_request.headers.get("x-admin-token"))
+    job = get_job_manager().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}/results")
+async def get_job_results_endpoint(job_id: str, http_request: Request, offset: int = 0):
+    """Stream results produced so far as JSON lines, starting at offset (admin only)"""
+    _require_admin(http_request.headers.get("x-admin-token"))
+    manager = get_job_manager()
+    if manager.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return StreamingResponse(manager.iter_results(job_id, offset), media_type="application/x-ndjson")
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job_endpoint(job_id: str, http_request: Request):
+    """Cancel a queued or running job (finished chunks are kept; admin only)"""
+    _require_admin(http_request.headers.get("x-admin-token"))
+    job = get_job_manager().cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"jobId": job_id, "status": job["status"]}
+
+class ProfileRequest(BaseModel):
+    requests: int = 20
+
+@app.post("/admin/profile")
+async def start_profile_endpoint(request: ProfileRequest, http_request: Request):
+    """Profile the next N pipeline runs with cProfile (admin only)"""
+    _require_admin(http_request.headers.get("x-admin-token"))
+    if request.requests < 1:
+        raise HTTPException(status_code=400, detail="requests must be at least 1")
+    get_profiler().start(request.requests)
+    return {"active": True, "remaining": request.requests}
+
+@app.get("/admin/profile")
+async def profile_report_endpoint(http_request: Request, sort: str = "cumulative", limit: int = 40):
+    """Aggregated cProfile report for the samples collected so far (admin only)"""
+    _require_admin(http_request.headers.get("x-admin-token"))
+    try:
+        return get_profiler().report(sort, limit)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Unknown sort key: {e}")
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8000))
     uvicorn.run(
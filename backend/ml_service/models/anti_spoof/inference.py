@@ -0,0 +1,74 @@
+import torch
+from torch import nn
+
+from .MiniFASNet import Conv_block, Linear_block, SEModule, MiniFASNet
+from .MultiFTNet import MultiFTNet
+
+# Inference-only build of the anti-spoof networks: drop the training-only
+# FTGenerator branch, fold every BatchNorm into the layer next to it, switch
+# to channels-last and freeze the graph with TorchScript.
+
+
+def extract_backbone(model: nn.Module) -> MiniFASNet:
+    """Return the classifier without MultiFTNet's FTGenerator branch"""
+    if isinstance(model, MultiFTNet):
+        return model.model
+    return model
+
+
+def _fold_conv_bn(conv: nn.Conv2d, bn: nn.BatchNorm2d) -> nn.Conv2d:
+    """conv followed by bn -> a single conv with bias"""
+    fused = nn.Conv2d(conv.in_channels, conv.out_channels, conv.kernel_size, stride=conv.stride,
+                      padding=conv.padding, dilation=conv.dilation, groups=conv.groups, bias=True)
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    bias = conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+    fused.weight.copy_(conv.weight * scale.reshape(-1, 1, 1, 1))
+    fused.bias.copy_((bias - bn.running_mean) * scale + bn.bias)
+    return fused
+
+
+def _fold_bn_linear(bn: nn.BatchNorm1d, linear: nn.Linear) -> nn.Linear:
+    """bn followed by linear -> a single linear with bias"""
+    fused = nn.Linear(linear.in_features, linear.out_features, bias=True)
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    shift = bn.bias - bn.running_mean * scale
+    bias = linear.bias if linear.bias is not None else torch.zeros(linear.out_features)
+    fused.weight.copy_(linear.weight * scale)
+    fused.bias.copy_(linear.weight @ shift + bias)
+    return fused
+
+
+@torch.no_grad()
+def fold_batchnorm(model: MiniFASNet) -> MiniFASNet:
+    """Fold every BatchNorm of a MiniFASNet in place (eval mode only)"""
+    model.eval()
+    for module in model.modules():
+        if isinstance(module, (Conv_block, Linear_block)):
+            module.conv = _fold_conv_bn(module.conv, module.bn)
+            module.bn = nn.Identity()
+        elif isinstance(module, SEModule):
+            module.fc1 = _fold_conv_bn(module.fc1, module.bn1)
+            module.bn1 = nn.Identity()
+            module.fc2 = _fold_conv_bn(module.fc2, module.bn2)
+            module.bn2 = nn.Identity()
+    # Head: bn -> dropout (identity in eval) -> prob
+    model.prob = _fold_bn_linear(model.bn, model.prob)
+    model.bn = nn.Identity()
+    model.drop = nn.Identity()
+    return model
+
+
+@torch.no_grad()
+def build_inference_model(model: nn.Module, input_size=(80, 80), channels_last: bool = True) -> torch.jit.ScriptModule:
+    """
+    Frozen TorchScript graph for a (Multi)MiniFASNet
+
+    input_size is (width, height). When channels_last is set, callers should
+    pass inputs in torch.channels_last memory format.
+    """
+    model = fold_batchnorm(extract_backbone(model))
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+    model = model.to(memory_format=memory_format)
+    example = torch.zeros(1, 3, input_size[1], input_size[0]).contiguous(memory_format=memory_format)
+    traced = torch.jit.trace(model, example)
+    return torch.jit.freeze(traced.eval())
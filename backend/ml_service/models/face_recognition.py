@@ -3,8 +3,12 @@ from typing import List
 import os
 import gc
 
+from services.model_registry import get_registry
+from services.execution_plan import configure_torch
+
 # NOTE: torch is NOT imported at module level to save memory at startup.
 # It is lazy-loaded inside FaceEmbeddingModel._ensure_model_loaded()
+# The FaceNet weights live in the model registry, which may unload them when idle.
 
 
 class FaceEmbeddingModel:
@@ -13,8 +17,8 @@ class FaceEmbeddingModel:
     def __init__(self):
         """Initialize the model reference (model loads lazily on first use)"""
         self.device = None
-        self.model = None
         self._torch = None
+        get_registry().register("facenet", self._load_model)
         print(f"✅ FaceEmbeddingModel initialized (model will load on first use)")
     
     def _ensure_torch(self):
@@ -25,35 +29,33 @@ class FaceEmbeddingModel:
         import torch
         self._torch = torch
         
-        # Memory optimizations for constrained environments (Railway)
-        torch.set_num_threads(1)
-        try:
-            torch.set_num_interop_threads(1)
-        except RuntimeError:
-            pass  # Already set or threads already created
+        # Thread counts come from the execution plan, shared with the anti-spoof models
+        configure_torch(torch)
         torch.set_grad_enabled(False)
         
         self.device = torch.device('cpu')
         return torch
     
-    def _ensure_model_loaded(self):
-        """Lazy-load the FaceNet model only when first needed"""
-        if self.model is not None:
-            return
-        
+    def _load_model(self):
+        """Load the FaceNet model (called by the model registry)"""
         torch = self._ensure_torch()
         
-        print("⏳ Loading FaceNet model (first request)...")
+        print("⏳ Loading FaceNet model...")
         try:
             from facenet_pytorch import InceptionResnetV1
-            self.model = InceptionResnetV1(pretrained='vggface2').eval().to(self.device)
+            model = InceptionResnetV1(pretrained='vggface2').eval().to(self.device)
             # Free any cached memory after loading
             gc.collect()
             print("✅ FaceNet model loaded successfully")
+            return model
         except Exception as e:
             print(f"❌ Failed to load FaceNet model: {e}")
             raise
     
+    def _ensure_model_loaded(self):
+        """Get the FaceNet model, loading (or reloading) it only when needed"""
+        return get_registry().get("facenet")
+    
     def generate_embedding(self, face_image: np.ndarray) -> np.ndarray:
         """
         Generate 512-dimensional embedding from preprocessed face image
@@ -64,7 +66,7 @@ class FaceEmbeddingModel:
         Returns:
             512-dimensional embedding vector
         """
-        self._ensure_model_loaded()
+        model = self._ensure_model_loaded()
         torch = self._torch
         
         # Convert to tensor
@@ -73,7 +75,7 @@ class FaceEmbeddingModel:
         
         # Generate embedding
         with torch.no_grad():
-            embedding = self.model(face_tensor)
+            embedding = model(face_tensor)
         
         # Convert to numpy and normalize
         embedding_np = embedding.cpu().numpy().flatten()
@@ -88,6 +90,32 @@ class FaceEmbeddingModel:
         
         return embedding_np
     
+    def generate_embeddings(self, face_batch: np.ndarray) -> np.ndarray:
+        """
+        Generate L2-normalized embeddings for a batch of preprocessed faces
+        
+        Args:
+            face_batch: NCHW float32 batch (N x 3 x 160 x 160, normalized to [0,1]),
+                        e.g. from services.preprocessing.FacePreprocessor
+        
+        Returns:
+            N x 512 array of embeddings
+        """
+        model = self._ensure_model_loaded()
+        torch = self._torch
+        
+        # Shares memory with the preprocessing buffer, no copy
+        face_tensor = torch.from_numpy(face_batch).to(self.device)
+        
+        with torch.no_grad():
+            embeddings = model(face_tensor).cpu().numpy()
+        
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        np.divide(embeddings, norms, out=embeddings, where=norms > 0)
+        
+        del face_tensor
+        return embeddings
+    
     def compare_embeddings(self, embedding1: np.ndarray, embedding2: np.ndarray) -> float:
         """
         Compare two face embeddings using cosine similarity
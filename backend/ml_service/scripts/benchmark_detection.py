@@ -0,0 +1,59 @@
+"""
+Face detection throughput as the detector pool grows
+
+Runs the same number of detections through DetectorPool with as many
+threads as pooled instances. Needs mediapipe and models/blaze_face_short_range.tflite
+(python scripts/download_models.py).
+Usage: python scripts/benchmark_detection.py [--image face.jpg] [--detections 400] [--max-size N]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from services.face_detection import DetectorPool, _create_detector
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--image", help="RGB image to detect on (default: random 640x480 frame)")
+    parser.add_argument("--detections", type=int, default=400)
+    parser.add_argument("--max-size", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    import mediapipe as mp
+    if args.image:
+        frame = np.asarray(Image.open(args.image).convert("RGB"))
+    else:
+        frame = np.random.default_rng(0).integers(0, 256, (480, 640, 3), dtype=np.uint8)
+    mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=np.ascontiguousarray(frame))
+
+    sizes = sorted({1, *[2 ** i for i in range(1, args.max_size.bit_length())], args.max_size})
+    print(f"📏 {args.detections} detections on {frame.shape[1]}x{frame.shape[0]}, {os.cpu_count()} CPUs")
+    baseline = None
+    for size in sizes:
+        pool = DetectorPool(_create_detector, max_size=size)
+
+        def detect(_):
+            with pool.checkout() as detector:
+                return detector.detect(mp_image)
+
+        with ThreadPoolExecutor(max_workers=size) as executor:
+            list(executor.map(detect, range(size)))  # create and warm every instance
+            start = time.perf_counter()
+            list(executor.map(detect, range(args.detections)))
+            elapsed = time.perf_counter() - start
+        pool.close()
+
+        throughput = args.detections / elapsed
+        baseline = baseline or throughput
+        print(f"pool size {size:3d}   {throughput:8.1f} detections/s   x{throughput / baseline:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Measure what a second anti-spoof scale costs compared with a second request
+
+A "request" is base64 JPEG decode + liveness on the decoded frame (face
+detection is left out, so the request cost is an underestimate).
+Usage: python scripts/benchmark_liveness.py [--faces 1] [--iterations 50]
+"""
+import argparse
+import base64
+import io
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from services.face_detection import base64_to_image
+from services.liveness_detection import ANTI_SPOOF_DIR, AntiSpoofPredictor, LivenessEngine
+
+CHECKPOINT = "2.7_80x80_MiniFASNetV2.pth"
+
+
+def make_frame_b64(width=1280, height=720) -> str:
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(frame).save(buffer, format="JPEG", quality=90)
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def timed(fn, iterations) -> float:
+    fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--faces", type=int, default=1, help="faces per frame (batched)")
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    model_file = os.path.join(ANTI_SPOOF_DIR, CHECKPOINT)
+    # Second scale reuses the shipped checkpoint at the 4.0 crop scale
+    single = LivenessEngine([(AntiSpoofPredictor(model_file), 1.0)])
+    dual = LivenessEngine([(AntiSpoofPredictor(model_file), 1.0),
+                           (AntiSpoofPredictor(model_file, scale=4.0), 1.0)])
+
+    frame_b64 = make_frame_b64()
+    bboxes = [{'x': 200 + 220 * i, 'y': 200, 'width': 180, 'height': 220} for i in range(args.faces)]
+
+    def request(engine):
+        return lambda: engine.predict(base64_to_image(frame_b64), bboxes)
+
+    one_scale = timed(request(single), args.iterations)
+    two_scales = timed(request(dual), args.iterations)
+    print(f"📏 {args.faces} face(s) per frame, {args.iterations} iterations")
+    print(f"1 scale, 1 request    {one_scale:8.2f} ms")
+    print(f"1 scale, 2 requests   {2 * one_scale:8.2f} ms")
+    print(f"2 scales, 1 request   {two_scales:8.2f} ms  (+{two_scales - one_scale:.2f} ms for the second scale)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Offline bulk embedding of a directory or .zip/.tar archive of face images
+
+Images are streamed in sorted order and decoded, detected, quality-gated,
+cropped and preprocessed in a process pool. The main process embeds them in
+batches with FaceEmbeddingModel and appends each batch to:
+
+  OUT.f32              N x 512 float32 rows, no header
+                       (np.fromfile("OUT.f32", np.float32).reshape(-1, 512))
+  OUT.ids              one image name per line, line i <-> row i
+  OUT.failed.jsonl     {"id", "error"} for images without a usable face
+  OUT.checkpoint.json  progress, rewritten atomically after every batch
+
+After a crash, the same command resumes from the last checkpoint. Output
+written past the checkpoint is truncated first, so no image is embedded twice.
+Usage: python scripts/bulk_embed.py SOURCE OUT [--workers N] [--batch-size 32] [--restart]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from services.batch_jobs import count_image_files, iter_image_files
+from services.execution_plan import available_cpus
+from services.gallery import EMBEDDING_DIM
+
+
+def prepare_face(data: bytes):
+    """Worker: encoded image -> (3x160x160 float32 face, quality) or (None, error)"""
+    from services import pipeline
+    from services.face_detection import bytes_to_image
+    from services.preprocessing import get_preprocessor
+    try:
+        face_region, quality = pipeline.crop_face(bytes_to_image(data))
+    except pipeline.PipelineError as e:
+        return None, e.detail
+    except Exception as e:
+        return None, f"Could not decode image: {e}"
+    face_batch = get_preprocessor().prepare([face_region])
+    return face_batch[0].copy(), quality
+
+
+class BulkOutput:
+    """Append-only output files plus the checkpoint that says how much of them is valid"""
+
+    def __init__(self, prefix: str, source: str, total: int, restart: bool):
+        self.paths = {kind: f"{prefix}.{kind}" for kind in ("f32", "ids", "failed.jsonl", "checkpoint.json")}
+        self.state = {"source": os.path.abspath(source), "dim": EMBEDDING_DIM, "dtype": "float32",
+                      "total": total, "processed": 0, "rows": 0, "failed": 0, "complete": False}
+        if not restart and os.path.exists(self.paths["checkpoint.json"]):
+            with open(self.paths["checkpoint.json"]) as f:
+                saved = json.load(f)
+            if saved["source"] != self.state["source"]:
+                raise SystemExit(f"❌ {prefix} was written from {saved['source']}; use --restart to overwrite")
+            self.state.update(saved, total=total)
+
+        # Drop anything written after the checkpoint (a crash mid-batch)
+        with open(self.paths["f32"], "ab") as f:
+            f.truncate(self.state["rows"] * EMBEDDING_DIM * 4)
+        self._truncate_lines(self.paths["ids"], self.state["rows"])
+        self._truncate_lines(self.paths["failed.jsonl"], self.state["failed"])
+
+        self._vectors = open(self.paths["f32"], "ab")
+        self._ids = open(self.paths["ids"], "a")
+        self._failed = open(self.paths["failed.jsonl"], "a")
+
+    @staticmethod
+    def _truncate_lines(path: str, keep: int):
+        lines = []
+        if os.path.exists(path):
+            with open(path) as f:
+                lines = [line for _, line in zip(range(keep), f)]
+        with open(path, "w") as f:
+            f.writelines(lines)
+
+    def write_batch(self, ids, embeddings: np.ndarray, failures, processed: int):
+        self._vectors.write(np.ascontiguousarray(embeddings, dtype=np.float32).tobytes())
+        self._ids.writelines(f"{item_id}\n" for item_id in ids)
+        self._failed.writelines(json.dumps({"id": item_id, "error": error}) + "\n" for item_id, error in failures)
+        for f in (self._vectors, self._ids, self._failed):
+            f.flush()
+            os.fsync(f.fileno())
+        self.state["rows"] += len(ids)
+        self.state["failed"] += len(failures)
+        self.state["processed"] += processed
+        self.save()
+
+    def save(self):
+        tmp = self.paths["checkpoint.json"] + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.paths["checkpoint.json"])
+
+    def close(self):
+        for f in (self._vectors, self._ids, self._failed):
+            f.close()
+
+
+def stream_faces(executor, items, in_flight: int):
+    """Submit items to the pool with at most in_flight outstanding; yield results in order"""
+    pending = deque()
+    for item_id, read in items:
+        pending.append((item_id, executor.submit(prepare_face, read())))
+        if len(pending) >= in_flight:
+            item_id, future = pending.popleft()
+            yield (item_id, *future.result())
+    while pending:
+        item_id, future = pending.popleft()
+        yield (item_id, *future.result())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("source", help="directory, .zip or .tar(.gz) of images")
+    parser.add_argument("output", help="output prefix, e.g. exports/users-2024-06")
+    parser.add_argument("--workers", type=int, default=available_cpus(),
+                        help="decode/detect processes")
+    parser.add_argument("--batch-size", type=int, default=32, help="faces per FaceNet batch and checkpoint")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    args = parser.parse_args()
+
+    total = count_image_files(args.source)
+    out = BulkOutput(args.output, args.source, total, args.restart)
+    state = out.state
+    if state["complete"] and state["processed"] >= total:
+        print(f"✅ {args.output} is already complete ({state['rows']} embeddings)")
+        return
+    state["complete"] = False
+    print(f"📦 {total} images in {args.source}; resuming at {state['processed']}" if state["processed"]
+          else f"📦 {total} images in {args.source}")
+
+    from models.face_recognition import get_model
+    model = get_model()
+
+    items = iter_image_files(args.source)
+    for _ in range(state["processed"]):
+        next(items, None)
+
+    start, done = time.perf_counter(), 0
+    ids, faces, failures, consumed = [], [], [], 0
+
+    def flush():
+        nonlocal ids, faces, failures, consumed, done
+        embeddings = model.generate_embeddings(np.stack(faces)) if faces else np.empty((0, EMBEDDING_DIM))
+        out.write_batch(ids, embeddings, failures, consumed)
+        done += consumed
+        rate = done / (time.perf_counter() - start)
+        eta = (total - state["processed"]) / rate if rate else 0
+        print(f"  {state['processed']:>8}/{total}  {rate:7.1f} images/s  "
+              f"{state['failed']} failed  ETA {eta:5.0f}s", flush=True)
+        ids, faces, failures, consumed = [], [], [], 0
+
+    # spawn: workers load mediapipe themselves instead of inheriting torch threads
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        for item_id, face, result in stream_faces(executor, items, in_flight=args.workers * 4):
+            consumed += 1
+            if face is None:
+                failures.append((item_id, result))
+            else:
+                ids.append(item_id)
+                faces.append(face)
+            if consumed >= args.batch_size:
+                flush()
+        if consumed:
+            flush()
+
+    state["complete"] = True
+    out.save()
+    out.close()
+    elapsed = time.perf_counter() - start
+    print(f"✅ {done} images in {elapsed:.1f}s ({done / elapsed if elapsed else 0:.1f} images/s): "
+          f"{state['rows']} embeddings, {state['failed']} failed -> {args.output}.f32")
+
+
+if __name__ == "__main__":
+    main()
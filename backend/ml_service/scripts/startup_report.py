@@ -0,0 +1,153 @@
+"""
+Cold-start report: import time and RSS per startup stage, with a boot budget check
+
+Imports the service one stage at a time in this fresh process and prints the
+wall time and RSS growth of each stage. Then it lists the slowest packages
+behind `import main` (python -X importtime). Finally it boots the service
+under uvicorn and times it until the first healthy response. With --models,
+each model is also loaded through the registry.
+
+With --budget-ms / --budget-mb (or ML_BOOT_BUDGET_MS / ML_BOOT_BUDGET_MB) the
+script exits 1 if the boot is over budget or a heavy dependency (torch,
+mediapipe, ...) was imported before the first request.
+Usage: python scripts/startup_report.py [--models] [--budget-ms 4000] [--budget-mb 300]
+"""
+import argparse
+import importlib
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import defaultdict
+
+ML_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ML_DIR)
+from services.model_registry import current_rss_bytes
+
+IMPORT_STAGES = [
+    ("numpy", "numpy"),
+    ("PIL", "PIL.Image"),
+    ("fastapi", "fastapi"),
+    ("uvicorn", "uvicorn"),
+    ("service (main)", "main"),
+]
+# Must stay behind model-load boundaries, never imported by `import main`
+HEAVY_MODULES = ("torch", "torchvision", "facenet_pytorch", "mediapipe", "cv2")
+MODEL_STAGES = ("face_detector", "anti_spoof", "facenet")
+
+
+def measure(label: str, fn):
+    start_rss = current_rss_bytes()
+    start = time.perf_counter()
+    error = None
+    try:
+        fn()
+    except Exception as e:
+        error = e
+    elapsed = (time.perf_counter() - start) * 1000
+    grown = (current_rss_bytes() - start_rss) / 1024 / 1024
+    total = current_rss_bytes() / 1024 / 1024
+    status = f"   ⚠️ {type(error).__name__}: {error}" if error else ""
+    print(f"{label:<24} {elapsed:9.1f} ms  {grown:+8.1f} MB   (RSS {total:6.1f} MB){status}")
+
+
+def importtime_breakdown(top: int):
+    """Self import time of `import main`, summed per top-level package"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ML_DIR, capture_output=True, text=True,
+    )
+    per_package = defaultdict(int)
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        per_package[name.strip().split(".")[0]] += int(self_us)
+    print(f"\nSlowest packages behind `import main` (self time, fresh interpreter):")
+    for package, us in sorted(per_package.items(), key=lambda kv: -kv[1])[:top]:
+        print(f"  {package:<22} {us / 1000:9.1f} ms")
+
+
+def boot_service(timeout: float = 120.0):
+    """Start uvicorn on a free port; return (ms to first 200 on /, RSS MB of the server)"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    with tempfile.TemporaryDirectory() as job_dir:
+        env = {**os.environ, "BATCH_JOB_DIR": job_dir}
+        start = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+            cwd=ML_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            while time.perf_counter() - start < timeout:
+                if server.poll() is not None:
+                    raise RuntimeError(f"service exited with code {server.returncode}")
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                        if response.status == 200:
+                            break
+                except OSError:
+                    time.sleep(0.05)
+            else:
+                raise RuntimeError(f"service not healthy after {timeout:.0f}s")
+            elapsed = (time.perf_counter() - start) * 1000
+            with open(f"/proc/{server.pid}/statm") as f:
+                rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+            return elapsed, rss
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--models", action="store_true", help="also load every model through the registry")
+    parser.add_argument("--budget-ms", type=float, default=float(os.environ.get("ML_BOOT_BUDGET_MS", "0")),
+                        help="fail if boot to first healthy response takes longer (0 = no check)")
+    parser.add_argument("--budget-mb", type=float, default=float(os.environ.get("ML_BOOT_BUDGET_MB", "0")),
+                        help="fail if the booted service's RSS is larger (0 = no check)")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    os.chdir(ML_DIR)
+    print(f"{'stage':<24} {'time':>12}  {'RSS growth':>11}")
+    for label, module in IMPORT_STAGES:
+        measure(label, lambda m=module: importlib.import_module(m))
+    heavy = [m for m in HEAVY_MODULES if m in sys.modules]
+
+    if args.models:
+        from models.face_recognition import get_model
+        from services.model_registry import get_registry
+        get_model()  # registers "facenet"
+        for name in MODEL_STAGES:
+            measure(f"load {name}", lambda n=name: get_registry().get(n))
+
+    importtime_breakdown(args.top)
+
+    boot_ms, boot_rss = boot_service()
+    print(f"\n🚀 Service boot: {boot_ms:.0f} ms to first healthy response, RSS {boot_rss:.1f} MB")
+    if heavy:
+        print(f"⚠️ Heavy modules imported by `import main`: {', '.join(heavy)}")
+
+    failures = []
+    if args.budget_ms or args.budget_mb:
+        if heavy:
+            failures.append(f"heavy modules loaded at import: {', '.join(heavy)}")
+        if args.budget_ms and boot_ms > args.budget_ms:
+            failures.append(f"boot {boot_ms:.0f} ms > budget {args.budget_ms:.0f} ms")
+        if args.budget_mb and boot_rss > args.budget_mb:
+            failures.append(f"RSS {boot_rss:.1f} MB > budget {args.budget_mb:.0f} MB")
+        for failure in failures:
+            print(f"❌ {failure}")
+        if not failures:
+            print("✅ Within boot budget")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Check that the folded/frozen anti-spoof model matches the eager one
+
+Compares class probabilities on random and real-range inputs, then reports
+latency and weight memory. Exits non-zero if probabilities differ by more
+than --tolerance.
+Usage: python scripts/verify_liveness_optimization.py [--batch 8] [--iterations 50]
+"""
+import argparse
+import copy
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from models.anti_spoof.MultiFTNet import MultiFTNet
+from models.anti_spoof.inference import extract_backbone, fold_batchnorm
+from services.liveness_detection import ANTI_SPOOF_DIR, AntiSpoofPredictor
+
+CHECKPOINT = "2.7_80x80_MiniFASNetV2.pth"
+
+
+def tensor_bytes(module: torch.nn.Module) -> int:
+    return sum(t.numel() * t.element_size() for t in list(module.parameters()) + list(module.buffers()))
+
+
+def timed(fn, iterations) -> float:
+    fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--tolerance", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    model_file = os.path.join(ANTI_SPOOF_DIR, CHECKPOINT)
+    eager = AntiSpoofPredictor(model_file, optimize=False)
+    optimized = AntiSpoofPredictor(model_file, optimize=True)
+    w, h = eager.input_size
+
+    torch.manual_seed(0)
+    batch = (torch.rand(args.batch, 3, h, w) * 255).numpy()
+    diff = abs(eager.predict_batch(batch) - optimized.predict_batch(batch)).max()
+
+    eager_ms = timed(lambda: eager.predict_batch(batch), args.iterations)
+    optimized_ms = timed(lambda: optimized.predict_batch(batch), args.iterations)
+
+    # The old predictor allocated a full MultiFTNet, FTGenerator included
+    legacy_bytes = tensor_bytes(MultiFTNet(num_classes=3, conv6_kernel=((h + 15) // 16, (w + 15) // 16)))
+    folded_bytes = tensor_bytes(fold_batchnorm(extract_backbone(copy.deepcopy(eager.model))))
+
+    print(f"max |Δp|           {diff:.2e} (tolerance {args.tolerance:.0e})")
+    print(f"eager              {eager_ms:8.2f} ms / batch of {args.batch}")
+    print(f"folded + frozen    {optimized_ms:8.2f} ms / batch of {args.batch}")
+    print(f"weights            {legacy_bytes / 1024:8.1f} KiB (MultiFTNet) -> {folded_bytes / 1024:.1f} KiB (folded)")
+
+    if diff > args.tolerance:
+        print("❌ Optimized model diverges from eager model")
+        sys.exit(1)
+    print("✅ Optimized model matches eager model")
+
+
+if __name__ == "__main__":
+    main()
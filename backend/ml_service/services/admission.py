@@ -0,0 +1,223 @@
+import asyncio
+import bisect
+import itertools
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+
+from services.timing import stage
+from services.execution_plan import get_execution_plan
+
+# Admission control in front of each model: at most ADMISSION_MAX_IN_FLIGHT
+# requests run at once, the rest wait in a bounded priority queue. Requests
+# that cannot be served in time are turned away immediately with Retry-After
+# instead of queueing until the caller has already given up.
+
+# Priority classes, highest first. A class of rank r may only fill
+# (n - r) / n of the queue, so lower classes always leave headroom above them.
+ADMISSION_PRIORITIES = [
+    c.strip() for c in os.environ.get("ADMISSION_PRIORITIES", "login,enrollment,batch").split(",") if c.strip()
+]
+ADMISSION_DEFAULT_PRIORITY = os.environ.get("ADMISSION_DEFAULT_PRIORITY", "enrollment")
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", "0"))  # 0 = execution plan workers
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", "32"))
+ADMISSION_DEFAULT_TIMEOUT_MS = int(os.environ.get("ADMISSION_DEFAULT_TIMEOUT_MS", "0"))  # 0 = no deadline
+
+# Model behind each services/pipeline.py task
+TASK_MODELS = {
+    "detect": "face_detector",
+    "embed": "facenet",
+    "liveness": "anti_spoof",
+}
+
+
+class AdmissionRejected(HTTPException):
+    """Fast rejection: 429 when the class's queue share is full, 503 when overloaded or out of time"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        super().__init__(status_code, detail, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+def priority_rank(name: Optional[str]) -> int:
+    """Rank of a priority class (0 = highest); raises ValueError for unknown names"""
+    name = name or ADMISSION_DEFAULT_PRIORITY
+    if name not in ADMISSION_PRIORITIES:
+        raise ValueError(f"Unknown priority '{name}'; expected one of {ADMISSION_PRIORITIES}")
+    return ADMISSION_PRIORITIES.index(name)
+
+
+def deadline_from_timeout(timeout_ms: Optional[float]) -> Optional[float]:
+    """Monotonic deadline for a relative timeout (caller clocks are never compared)"""
+    if not timeout_ms:
+        timeout_ms = ADMISSION_DEFAULT_TIMEOUT_MS
+    if not timeout_ms or timeout_ms <= 0:
+        return None
+    return time.monotonic() + timeout_ms / 1000.0
+
+
+class ModelAdmission:
+    """In-flight limit and priority queue for one model (event-loop only, no locking)"""
+
+    def __init__(self, name: str, max_in_flight: int, max_queue: int, classes: int):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.classes = classes
+        self.in_flight = 0
+        self._waiters: List[tuple] = []  # sorted (rank, seq, future)
+        self._seq = itertools.count()
+        self._service_time = 0.1  # EWMA of seconds per request
+        self.counters = {"admitted": 0, "rejected": 0, "shed": 0, "expired": 0}
+
+    def _queue_limit(self, rank: int) -> int:
+        return max(1, math.ceil(self.max_queue * (self.classes - rank) / self.classes))
+
+    def estimated_wait(self, ahead: int) -> float:
+        """Seconds until a request with `ahead` waiters in front of it starts"""
+        return (ahead // self.max_in_flight + 1) * self._service_time
+
+    def _grant_next(self):
+        while self._waiters and self.in_flight < self.max_in_flight:
+            _, _, future = self._waiters.pop(0)
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+
+    def _release(self, elapsed: Optional[float] = None):
+        self.in_flight -= 1
+        if elapsed is not None:
+            self._service_time = 0.8 * self._service_time + 0.2 * elapsed
+        self._grant_next()
+
+    def _remove(self, entry: tuple):
+        try:
+            self._waiters.remove(entry)
+        except ValueError:
+            pass
+
+    def check_deadline(self, deadline: Optional[float]) -> None:
+        """Drop work whose deadline has already passed instead of spending inference on it"""
+        if deadline is not None and time.monotonic() >= deadline:
+            self.counters["expired"] += 1
+            raise AdmissionRejected(503, "Deadline exceeded before inference", self._service_time)
+
+    async def _acquire(self, rank: int, deadline: Optional[float]):
+        self.check_deadline(deadline)
+        now = time.monotonic()
+
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            return
+
+        queue_full = len(self._waiters) >= self._queue_limit(rank)
+        # Make room by shedding the newest waiter of a lower class, if any
+        victim = self._waiters[-1] if queue_full and self._waiters[-1][0] > rank else None
+        if queue_full and victim is None:
+            self.counters["rejected"] += 1
+            raise AdmissionRejected(429, f"{self.name} queue is full",
+                                    self.estimated_wait(len(self._waiters)))
+
+        # Only waiters of the same or a higher class are ahead (a victim never is),
+        # so the deadline is checked before anyone is shed for this arrival
+        ahead = bisect.bisect_right(self._waiters, (rank, math.inf))
+        if deadline is not None and now + self.estimated_wait(ahead) > deadline:
+            self.counters["rejected"] += 1
+            raise AdmissionRejected(503, f"{self.name} cannot start before the request deadline",
+                                    self.estimated_wait(ahead))
+
+        if victim is not None:
+            self._waiters.pop()
+            victim[2].set_exception(AdmissionRejected(
+                503, f"Shed from {self.name} queue for higher-priority work",
+                self.estimated_wait(len(self._waiters))))
+            self.counters["shed"] += 1
+
+        loop = asyncio.get_running_loop()
+        entry = (rank, next(self._seq), loop.create_future())
+        bisect.insort(self._waiters, entry)
+        timer = None
+        if deadline is not None:
+            def expire():
+                if not entry[2].done():
+                    self._remove(entry)
+                    self.counters["expired"] += 1
+                    entry[2].set_exception(AdmissionRejected(
+                        503, "Deadline exceeded while queued", self._service_time))
+            timer = loop.call_at(loop.time() + (deadline - now), expire)
+        try:
+            await entry[2]
+        except asyncio.CancelledError:
+            if entry[2].done() and not entry[2].cancelled() and entry[2].exception() is None:
+                self._release()  # granted just as the caller went away
+            else:
+                self._remove(entry)
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+    @asynccontextmanager
+    async def slot(self, rank: int, deadline: Optional[float]):
+        with stage("queue"):
+            await self._acquire(rank, deadline)
+        self.counters["admitted"] += 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - start)
+
+    def metrics(self) -> dict:
+        return {
+            "inFlight": self.in_flight,
+            "maxInFlight": self.max_in_flight,
+            "queued": len(self._waiters),
+            "maxQueue": self.max_queue,
+            "serviceTimeMs": round(self._service_time * 1000, 1),
+            **self.counters,
+        }
+
+
+class AdmissionController:
+    """One ModelAdmission per model, created on first use"""
+
+    def __init__(self, max_in_flight: int = ADMISSION_MAX_IN_FLIGHT, max_queue: int = ADMISSION_MAX_QUEUE):
+        self.max_in_flight = max_in_flight or get_execution_plan().workers
+        self.max_queue = max_queue
+        self._models: Dict[str, ModelAdmission] = {}
+        self._shared: Optional[str] = None
+
+    def share(self, name: str, max_in_flight: int) -> None:
+        """Put every task behind one queue, for when all models run on the same workers"""
+        self.max_in_flight = max_in_flight
+        self._shared = name
+        self._models = {}
+
+    def for_task(self, task: str) -> ModelAdmission:
+        name = self._shared or TASK_MODELS.get(task, task)
+        if name not in self._models:
+            self._models[name] = ModelAdmission(
+                name, self.max_in_flight, self.max_queue, len(ADMISSION_PRIORITIES)
+            )
+        return self._models[name]
+
+    def metrics(self) -> dict:
+        return {
+            "priorities": ADMISSION_PRIORITIES,
+            "models": {name: m.metrics() for name, m in self._models.items()},
+        }
+
+
+# Global controller instance
+_controller = None
+
+def get_admission() -> AdmissionController:
+    """Get or create the singleton admission controller"""
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController()
+    return _controller
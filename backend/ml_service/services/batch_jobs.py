@@ -0,0 +1,416 @@
+import asyncio
+import json
+import os
+import re
+import tarfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from services import pipeline
+from services.face_detection import base64_to_image, bytes_to_image
+from services.gallery import get_gallery
+
+# Bulk enrollment / re-verification jobs: submitted over HTTP, executed on a
+# small dedicated thread pool through the batched embedding path, with state
+# and results persisted under BATCH_JOB_DIR so jobs survive restarts.
+
+BATCH_JOB_DIR = os.environ.get(
+    "BATCH_JOB_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "jobs")
+)
+BATCH_JOB_WORKERS = int(os.environ.get("BATCH_JOB_WORKERS", "1"))
+BATCH_JOB_BATCH_SIZE = int(os.environ.get("BATCH_JOB_BATCH_SIZE", "16"))
+# Faces per FaceNet forward; the gate is re-checked between forwards
+BATCH_JOB_FORWARD_BATCH = int(os.environ.get("BATCH_JOB_FORWARD_BATCH", "4"))
+# Finished jobs and their results are deleted after this long (0 keeps them)
+BATCH_JOB_RETENTION_HOURS = float(os.environ.get("BATCH_JOB_RETENTION_HOURS", "168"))
+# Directory/archive sources must live under this root (empty disables them)
+BATCH_JOB_INPUT_ROOT = os.environ.get("BATCH_JOB_INPUT_ROOT", "")
+
+OPERATIONS = ("embed", "enroll", "verify")
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+FINISHED = ("completed", "failed", "cancelled")
+_JOB_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class PriorityGate:
+    """Interactive requests hold the gate; bulk work waits until none are in flight"""
+
+    def __init__(self):
+        self._active = 0
+        self._cond = threading.Condition()
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @contextmanager
+    def interactive(self):
+        with self._cond:
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                if self._active == 0:
+                    self._cond.notify_all()
+
+    def wait_until_idle(self, timeout: Optional[float] = None) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: self._active == 0, timeout)
+
+
+def _is_image(name: str) -> bool:
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def _check_local_path(path: str) -> str:
+    if not BATCH_JOB_INPUT_ROOT:
+        raise ValueError("Local path sources are disabled; set BATCH_JOB_INPUT_ROOT")
+    root = os.path.realpath(BATCH_JOB_INPUT_ROOT)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise ValueError(f"Path must be inside BATCH_JOB_INPUT_ROOT: {path}")
+    if not os.path.exists(resolved):
+        raise ValueError(f"Path not found: {path}")
+    return resolved
+
+
+def _list_directory(root: str) -> List[str]:
+    names = []
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            if _is_image(name):
+                names.append(os.path.relpath(os.path.join(dirpath, name), root))
+    return sorted(names)
+
+
+def iter_image_files(path: str) -> Iterator[Tuple[str, Callable[[], bytes]]]:
+    """
+    (name, read) for every image in a directory, .zip or .tar archive
+
+    Names are sorted, so a count of items already handled is enough to resume.
+    Archives stay open while the generator is alive; call read() before advancing.
+    """
+    if os.path.isdir(path):
+        for name in _list_directory(path):
+            full = os.path.join(path, name)
+            yield name, (lambda p=full: open(p, "rb").read())
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for name in sorted(n for n in archive.namelist() if _is_image(n)):
+                yield name, (lambda n=name: archive.read(n))
+    else:
+        with tarfile.open(path) as archive:
+            members = sorted((m for m in archive.getmembers() if m.isfile() and _is_image(m.name)),
+                             key=lambda m: m.name)
+            for member in members:
+                yield member.name, (lambda m=member: archive.extractfile(m).read())
+
+
+def count_image_files(path: str) -> int:
+    if os.path.isdir(path):
+        return len(_list_directory(path))
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            return sum(1 for n in archive.namelist() if _is_image(n))
+    with tarfile.open(path) as archive:
+        return sum(1 for m in archive.getmembers() if m.isfile() and _is_image(m.name))
+
+
+class BatchJobManager:
+    """Creates, runs, persists and reports on batch jobs"""
+
+    def __init__(self, job_dir: str = BATCH_JOB_DIR, workers: int = BATCH_JOB_WORKERS,
+                 batch_size: int = BATCH_JOB_BATCH_SIZE, gate: Optional[PriorityGate] = None,
+                 forward_batch: int = BATCH_JOB_FORWARD_BATCH,
+                 retention_hours: float = BATCH_JOB_RETENTION_HOURS):
+        self.job_dir = job_dir
+        self.batch_size = batch_size
+        self.forward_batch = forward_batch
+        self.retention_seconds = retention_hours * 3600
+        self.gate = gate or PriorityGate()
+        os.makedirs(job_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch-job")
+        self._lock = threading.Lock()
+        self._cancelled = set()
+        # Coordinator mode: enrollments go to the shards, not the local gallery
+        self._coordinator = None
+        self._loop = None
+
+    def use_coordinator(self, coordinator, loop: asyncio.AbstractEventLoop) -> None:
+        """Route enrollments through a ShardCoordinator running on loop"""
+        self._coordinator = coordinator
+        self._loop = loop
+
+    # --- persistence ---
+
+    def _path(self, job_id: str, suffix: str) -> str:
+        return os.path.join(self.job_dir, f"{job_id}.{suffix}")
+
+    def _save(self, job: dict) -> None:
+        job["updatedAt"] = time.time()
+        tmp = self._path(job["id"], "json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(job, f)
+        os.replace(tmp, self._path(job["id"], "json"))
+
+    def _remove_input(self, job_id: str) -> None:
+        """Inline jobs keep their base64 face images on disk only until they finish"""
+        try:
+            os.remove(self._path(job_id, "input.jsonl"))
+        except FileNotFoundError:
+            pass
+
+    def purge_expired(self) -> int:
+        """Delete finished jobs (state, results, input) older than the retention period"""
+        if not self.retention_seconds:
+            return 0
+        cutoff = time.time() - self.retention_seconds
+        purged = 0
+        for name in os.listdir(self.job_dir):
+            if not name.endswith(".json"):
+                continue
+            job = self.get(name[:-len(".json")])
+            if job and job["status"] in FINISHED and job.get("updatedAt", 0) < cutoff:
+                for suffix in ("input.jsonl", "results.jsonl", "json"):
+                    try:
+                        os.remove(self._path(job["id"], suffix))
+                    except FileNotFoundError:
+                        pass
+                purged += 1
+        if purged:
+            print(f"📦 Purged {purged} expired batch job(s)")
+        return purged
+
+    def get(self, job_id: str) -> Optional[dict]:
+        if not _JOB_ID.fullmatch(job_id):
+            return None
+        try:
+            with open(self._path(job_id, "json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    # --- sources ---
+
+    def _iter_source(self, job: dict) -> Iterator[Tuple[str, callable, dict]]:
+        """Yield (item_id, load_image, extra) lazily, in a stable order"""
+        source = job["source"]
+        if source["type"] == "inline":
+            with open(self._path(job["id"], "input.jsonl")) as f:
+                for line in f:
+                    item = json.loads(line)
+                    yield item["id"], (lambda b64=item["image"]: base64_to_image(b64)), item
+        else:
+            for name, read in iter_image_files(source["path"]):
+                yield name, (lambda r=read: bytes_to_image(r())), {}
+
+    def _count(self, source: dict, items: Optional[list]) -> int:
+        if source["type"] == "inline":
+            return len(items)
+        return count_image_files(source["path"])
+
+    # --- lifecycle ---
+
+    def submit(self, operation: str, items: Optional[List[dict]] = None,
+               directory: Optional[str] = None, archive: Optional[str] = None) -> dict:
+        """Validate, persist and queue a job; raises ValueError on bad input"""
+        if operation not in OPERATIONS:
+            raise ValueError(f"operation must be one of {OPERATIONS}")
+        if sum(x is not None for x in (items, directory, archive)) != 1:
+            raise ValueError("Provide exactly one of images, directory or archive")
+        if self._coordinator is not None and operation == "verify" and (
+                items is None or any(item.get("embedding") is None for item in items)):
+            # The coordinator holds no gallery to look reference embeddings up in
+            raise ValueError("In coordinator mode, verify jobs need inline images with reference embeddings")
+
+        if items is not None:
+            source = {"type": "inline"}
+        elif directory is not None:
+            source = {"type": "directory", "path": _check_local_path(directory)}
+        else:
+            source = {"type": "archive", "path": _check_local_path(archive)}
+        try:
+            total = self._count(source, items)
+        except (tarfile.TarError, zipfile.BadZipFile, EOFError) as e:
+            raise ValueError(f"Not a readable .zip or .tar archive: {directory or archive}") from e
+
+        self.purge_expired()
+        job_id = uuid.uuid4().hex
+        if items is not None:
+            with open(self._path(job_id, "input.jsonl"), "w") as f:
+                for item in items:
+                    f.write(json.dumps(item) + "\n")
+
+        job = {
+            "id": job_id,
+            "operation": operation,
+            "source": source,
+            "status": "queued",
+            "total": total,
+            "processed": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "createdAt": time.time(),
+            "error": None,
+        }
+        self._save(job)
+        open(self._path(job_id, "results.jsonl"), "w").close()
+        self._executor.submit(self._run, job_id)
+        print(f"📦 Batch job {job_id}: {operation} x {job['total']}")
+        return job
+
+    def cancel(self, job_id: str) -> Optional[dict]:
+        job = self.get(job_id)
+        if job is None or job["status"] in FINISHED:
+            return job
+        with self._lock:
+            self._cancelled.add(job_id)
+        if job["status"] == "queued":
+            job["status"] = "cancelled"
+            self._save(job)
+            self._remove_input(job_id)
+        return job
+
+    def resume_pending(self) -> int:
+        """Re-queue jobs that were queued or running when the service stopped"""
+        self.purge_expired()
+        resumed = 0
+        for name in sorted(os.listdir(self.job_dir)):
+            if not name.endswith(".json"):
+                continue
+            job = self.get(name[:-len(".json")])
+            if job and job["status"] in ("queued", "running"):
+                self._executor.submit(self._run, job["id"])
+                resumed += 1
+        if resumed:
+            print(f"📦 Resumed {resumed} batch job(s)")
+        return resumed
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def iter_results(self, job_id: str, offset: int = 0) -> Iterator[str]:
+        """Result lines (JSONL) from offset onward, as currently persisted"""
+        with open(self._path(job_id, "results.jsonl")) as f:
+            for i, line in enumerate(f):
+                if i >= offset:
+                    yield line
+
+    # --- execution ---
+
+    def _finish_item(self, operation: str, item_id: str, extra: dict, result: dict) -> dict:
+        if "error" in result:
+            return {"id": item_id, "error": result["error"]}
+        embedding = result["embedding"]
+        if operation == "enroll":
+            if self._coordinator is None:
+                get_gallery().add(item_id, embedding)
+            else:
+                try:
+                    asyncio.run_coroutine_threadsafe(
+                        self._coordinator.enroll(item_id, embedding), self._loop
+                    ).result()
+                except Exception as e:
+                    return {"id": item_id, "error": f"Enrollment failed: {e}"}
+        elif operation == "verify":
+            reference = extra.get("embedding")
+            if reference is None and self._coordinator is None:
+                reference = get_gallery().get(item_id)
+            if reference is None:
+                return {"id": item_id, "error": "No reference embedding"}
+            reference = np.asarray(reference, dtype=np.float32)
+            similarity = float(np.dot(embedding, reference) / (
+                np.linalg.norm(embedding) * np.linalg.norm(reference)))
+            match, confidence = pipeline.classify_similarity(similarity)
+            return {"id": item_id, "similarity": similarity, "match": match,
+                    "confidence": confidence, "quality": result["quality"]}
+        return {"id": item_id, "embedding": embedding, "quality": result["quality"]}
+
+    def _run(self, job_id: str):
+        job = self.get(job_id)
+        if job is None or job["status"] in FINISHED:
+            return
+        job["status"] = "running"
+        self._save(job)
+
+        try:
+            # Resume: drop result lines past the last persisted checkpoint,
+            # then skip the items already accounted for
+            results_path = self._path(job_id, "results.jsonl")
+            with open(results_path) as f:
+                kept = [line for _, line in zip(range(job["processed"]), f)]
+            with open(results_path, "w") as f:
+                f.writelines(kept)
+
+            items = self._iter_source(job)
+            for _ in range(job["processed"]):
+                next(items, None)
+
+            with open(results_path, "a") as out:
+                while True:
+                    chunk = [item for _, item in zip(range(self.batch_size), items)]
+                    if not chunk:
+                        break
+                    if job_id in self._cancelled:
+                        job["status"] = "cancelled"
+                        break
+
+                    # Interactive traffic first: the gate is checked before every
+                    # decode, detection and FaceNet forward, not once per chunk
+                    images, decoded, lines = [], [], [None] * len(chunk)
+                    for i, (item_id, load, _) in enumerate(chunk):
+                        self.gate.wait_until_idle()
+                        try:
+                            images.append(load())
+                            decoded.append(i)
+                        except Exception as e:
+                            lines[i] = {"id": item_id, "error": f"Could not decode image: {e}"}
+
+                    results = pipeline.embed_many(images, yield_to=self.gate.wait_until_idle,
+                                                  forward_batch=self.forward_batch)
+                    for i, result in zip(decoded, results):
+                        item_id, _, extra = chunk[i]
+                        lines[i] = self._finish_item(job["operation"], item_id, extra, result)
+
+                    for line in lines:
+                        out.write(json.dumps(line) + "\n")
+                        job["failed" if "error" in line else "succeeded"] += 1
+                    out.flush()
+                    job["processed"] += len(chunk)
+                    self._save(job)
+
+            if job["status"] == "running":
+                job["status"] = "completed"
+        except Exception as e:
+            print(f"❌ Batch job {job_id} failed: {e}")
+            job["status"] = "failed"
+            job["error"] = str(e)
+        finally:
+            self._cancelled.discard(job_id)
+            self._save(job)
+            if job["status"] in FINISHED:
+                self._remove_input(job_id)
+            print(f"📦 Batch job {job_id} {job['status']} ({job['processed']}/{job['total']})")
+
+
+_priority_gate = PriorityGate()
+_manager = None
+
+def get_priority_gate() -> PriorityGate:
+    return _priority_gate
+
+def get_job_manager() -> BatchJobManager:
+    """Get or create the singleton job manager"""
+    global _manager
+    if _manager is None:
+        _manager = BatchJobManager(gate=_priority_gate)
+    return _manager
@@ -0,0 +1,206 @@
+import math
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# How inference uses the CPUs this container may actually run on: `workers`
+# requests in flight per model (admission slots, or worker processes in
+# process mode), each forward pass using `threads` torch intra-op threads,
+# with workers x threads <= CPUs. torch's thread count is process-wide, so
+# FaceNet and the anti-spoof models always share one setting.
+#
+#   throughput  one single-threaded worker per CPU (best under sustained load)
+#   latency     one worker using every CPU (fastest single request)
+#   auto        single-threaded on <= 2 CPUs, otherwise up to 4 threads per worker
+#   tune        benchmark every split on the loaded models at startup and keep the best
+
+EXECUTION_PLAN = os.environ.get("EXECUTION_PLAN", "auto")
+# Explicit torch intra-op thread count; overrides the plan (0 = use the plan)
+TORCH_INTRA_OP_THREADS = int(os.environ.get("TORCH_INTRA_OP_THREADS", "0"))
+EXECUTION_TUNE_ITERATIONS = int(os.environ.get("EXECUTION_TUNE_ITERATIONS", "8"))
+
+STRATEGIES = ("auto", "throughput", "latency", "tune")
+
+
+def _cgroup_cpu_limit() -> Optional[float]:
+    """CPU quota from cgroup v2 cpu.max or v1 cfs_quota_us/cfs_period_us, if any"""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0 and period > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def available_cpus() -> int:
+    """CPUs this process may use: affinity mask, capped by any cgroup quota"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    limit = _cgroup_cpu_limit()
+    if limit is not None:
+        cpus = min(cpus, max(1, math.ceil(limit)))
+    return max(1, cpus)
+
+
+def thread_candidates(cpus: int) -> List[int]:
+    """Intra-op thread counts worth trying: powers of two up to cpus, plus cpus"""
+    return sorted({1, cpus, *[2 ** i for i in range(cpus.bit_length()) if 2 ** i <= cpus]})
+
+
+class ExecutionPlan:
+    """A workers x threads split of the available CPUs"""
+
+    def __init__(self, cpus: int, threads: int, strategy: str, benchmark: Optional[dict] = None):
+        self.cpus = cpus
+        self.threads = max(1, min(threads, cpus))
+        self.workers = max(1, cpus // self.threads)
+        self.strategy = strategy
+        self.benchmark = benchmark
+
+    @classmethod
+    def for_strategy(cls, strategy: str, cpus: int) -> "ExecutionPlan":
+        if strategy not in STRATEGIES:
+            raise ValueError(f"EXECUTION_PLAN must be one of {STRATEGIES}, got '{strategy}'")
+        if TORCH_INTRA_OP_THREADS:
+            return cls(cpus, TORCH_INTRA_OP_THREADS, "fixed")
+        if strategy == "throughput":
+            threads = 1
+        elif strategy == "latency":
+            threads = cpus
+        else:
+            # tune starts from the auto plan until the benchmark has run
+            threads = 1 if cpus <= 2 else min(4, cpus // 2)
+        return cls(cpus, threads, strategy)
+
+    def metrics(self) -> dict:
+        metrics = {
+            "strategy": self.strategy,
+            "cpus": self.cpus,
+            "workers": self.workers,
+            "intraOpThreads": self.threads,
+        }
+        if self.benchmark is not None:
+            metrics["benchmark"] = self.benchmark
+        return metrics
+
+
+def configure_torch(torch) -> None:
+    """Apply the plan's thread counts; called by every model that loads torch"""
+    plan = get_execution_plan()
+    if torch.get_num_threads() != plan.threads:
+        torch.set_num_threads(plan.threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # Already set or threads already created
+
+
+def _benchmark_split(run: Callable[[], None], workers: int, iterations: int) -> dict:
+    """Single-request latency, then throughput with `workers` requests in flight"""
+    run()  # warm up at this thread count
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        run()
+        latencies.append((time.perf_counter() - start) * 1000)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        start = time.perf_counter()
+        list(executor.map(lambda _: run(), range(iterations * workers)))
+        elapsed = time.perf_counter() - start
+    return {
+        "latencyMs": round(statistics.median(latencies), 2),
+        "perSecond": round(iterations * workers / elapsed, 2),
+    }
+
+
+def _tune_targets() -> Tuple[Dict[str, Callable[[], None]], Dict[str, str]]:
+    """One single-face forward pass per torch model that can be loaded"""
+    targets, errors = {}, {}
+    try:
+        from models.face_recognition import get_model
+        model = get_model()
+        faces = np.random.default_rng(0).random((1, 3, 160, 160), dtype=np.float32)
+        model.generate_embeddings(faces)
+        targets["facenet"] = lambda: model.generate_embeddings(faces)
+    except Exception as e:
+        errors["facenet"] = str(e)
+    try:
+        from services.liveness_detection import get_liveness_engine
+        engine = get_liveness_engine()
+        batches = [(predictor, np.random.default_rng(0).random(
+            (1, 3, predictor.input_size[1], predictor.input_size[0]), dtype=np.float32) * 255)
+            for predictor, _ in engine.predictors]
+        targets["anti_spoof"] = lambda: [predictor.predict_batch(batch) for predictor, batch in batches]
+    except Exception as e:
+        errors["anti_spoof"] = str(e)
+    return targets, errors
+
+
+def autotune(iterations: int = EXECUTION_TUNE_ITERATIONS) -> ExecutionPlan:
+    """
+    Benchmark every workers x threads split on the loaded models and adopt the best
+
+    Each split is scored by throughput relative to the best split for each
+    model, averaged over models; splits within 10% of the top score are
+    decided by single-request latency.
+    """
+    global _plan
+    import torch
+    cpus = available_cpus()
+    targets, errors = _tune_targets()
+    if not targets:
+        print(f"⚠️ Execution auto-tune skipped, no model could be loaded: {errors}")
+        return get_execution_plan()
+
+    results = {}
+    for threads in thread_candidates(cpus):
+        torch.set_num_threads(threads)
+        results[threads] = {name: _benchmark_split(run, max(1, cpus // threads), iterations)
+                            for name, run in targets.items()}
+
+    best_rate = {name: max(r[name]["perSecond"] for r in results.values()) for name in targets}
+    scores = {t: sum(r[name]["perSecond"] / best_rate[name] for name in targets) / len(targets)
+              for t, r in results.items()}
+    top = max(scores.values())
+    threads = min((t for t in scores if scores[t] >= 0.9 * top),
+                  key=lambda t: sum(results[t][name]["latencyMs"] for name in targets))
+
+    benchmark = {
+        "candidates": {f"{max(1, cpus // t)}x{t}": {**results[t], "score": round(scores[t], 3)}
+                       for t in results},
+        "errors": errors,
+    }
+    _plan = ExecutionPlan(cpus, threads, "tune", benchmark)
+    torch.set_num_threads(_plan.threads)
+    # Worker processes started after this (process mode) inherit the choice
+    os.environ["TORCH_INTRA_OP_THREADS"] = str(_plan.threads)
+    print(f"🧭 Execution plan tuned: {_plan.workers} workers x {_plan.threads} threads on {cpus} CPUs")
+    return _plan
+
+
+_plan = None
+
+def get_execution_plan() -> ExecutionPlan:
+    """Get or create the process-wide execution plan"""
+    global _plan
+    if _plan is None:
+        _plan = ExecutionPlan.for_strategy(EXECUTION_PLAN, available_cpus())
+    return _plan
@@ -1,18 +1,45 @@
 import numpy as np
-from PIL import Image
+from PIL import Image, UnidentifiedImageError
 import io
 import base64
+import threading
+from contextlib import contextmanager
 from typing import Tuple, Optional
 import os
 
+from services.model_registry import get_registry
+from services.execution_plan import available_cpus
+
 # Lazy-loaded MediaPipe Tasks Face Detector
 # NOTE: mediapipe is NOT imported at module level to avoid cv2/libGL crash on Railway
 current_dir = os.path.dirname(os.path.abspath(__file__))
 model_path = os.path.join(current_dir, "..", "models", "blaze_face_short_range.tflite")
 
-_detector = None
 _mp_vision = None
 
+# Upload formats tried first by bytes_to_image: PIL's preinit() set plus WebP.
+# Any other format PIL can read is still accepted, but only an upload in one
+# of them makes PIL import the rest of its ~40 plugins.
+IMAGE_FORMATS = ("JPEG", "PNG", "GIF", "BMP", "DIB", "PPM", "WEBP")
+_image_plugins_loaded = False
+
+def _ensure_image_plugins():
+    global _image_plugins_loaded
+    if not _image_plugins_loaded:
+        Image.preinit()
+        from PIL import WebPImagePlugin  # noqa: F401
+        _image_plugins_loaded = True
+
+# Cheap quality pre-gate, run before the anti-spoof and embedding models
+QUALITY_GATE_ENABLED = os.environ.get("QUALITY_GATE_ENABLED", "true").lower() != "false"
+QUALITY_GATE_MIN_SHARPNESS = float(os.environ.get("QUALITY_GATE_MIN_SHARPNESS", "5.0"))
+QUALITY_GATE_MIN_BRIGHTNESS = float(os.environ.get("QUALITY_GATE_MIN_BRIGHTNESS", "40"))
+QUALITY_GATE_MAX_BRIGHTNESS = float(os.environ.get("QUALITY_GATE_MAX_BRIGHTNESS", "215"))
+QUALITY_GATE_MIN_FACE_PX = int(os.environ.get("QUALITY_GATE_MIN_FACE_PX", "48"))
+QUALITY_GATE_SAMPLE_PX = 64
+
+_LUMA_WEIGHTS = np.array([0.2989, 0.5870, 0.1140], dtype=np.float32)
+
 def _get_mp_vision():
     """Lazy-import mediapipe.tasks to avoid module-level cv2 import"""
     global _mp_vision
@@ -23,21 +50,101 @@ def _get_mp_vision():
     _mp_vision = vision
     return _mp_vision
 
-def _get_detector():
-    """Lazy-load the MediaPipe Face Detector on first use"""
-    global _detector
-    if _detector is not None:
-        return _detector
+# One MediaPipe FaceDetector must not serve two threads at once; each thread
+# checks an instance out of a bounded pool instead.
+DETECTOR_POOL_SIZE = int(os.environ.get("DETECTOR_POOL_SIZE", "0")) or available_cpus()
+
+
+class DetectorPool:
+    """
+    Bounded pool of MediaPipe face detectors with checkout/checkin semantics
+
+    Instances are created lazily, up to max_size; when all are checked out,
+    checkout() blocks until one is returned.
+    """
+
+    def __init__(self, factory, max_size: int = DETECTOR_POOL_SIZE):
+        self._factory = factory
+        self.max_size = max(1, max_size)
+        self._idle = []
+        self._created = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    @property
+    def created(self) -> int:
+        return self._created
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._created < self.max_size:
+                    self._created += 1
+                    break
+                self._cond.wait()
+        try:
+            return self._factory()
+        except Exception:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, detector):
+        with self._cond:
+            if not self._closed:
+                self._idle.append(detector)
+                self._cond.notify()
+                return
+            self._created -= 1
+        # Pool was evicted while this instance was in use
+        detector.close()
+
+    @contextmanager
+    def checkout(self):
+        detector = self.acquire()
+        try:
+            yield detector
+        finally:
+            self.release(detector)
+
+    def close(self):
+        """Close idle detectors; checked-out ones are closed on release"""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+        for detector in idle:
+            detector.close()
+
+
+def _create_detector():
     vision = _get_mp_vision()
     from mediapipe.tasks import python as mp_python
-    if os.path.exists(model_path):
-        base_options = mp_python.BaseOptions(model_asset_path=model_path)
-        options = vision.FaceDetectorOptions(base_options=base_options)
-        _detector = vision.FaceDetector.create_from_options(options)
-        print("✅ MediaPipe Face Detector loaded")
-    else:
-        print(f"⚠️ MediaPipe model not found at {model_path}. Face detection will be limited.")
-    return _detector
+    base_options = mp_python.BaseOptions(model_asset_path=model_path)
+    options = vision.FaceDetectorOptions(base_options=base_options)
+    return vision.FaceDetector.create_from_options(options)
+
+def _load_detector_pool():
+    """Create the MediaPipe Face Detector pool (called by the model registry)"""
+    # Raise rather than return None: the registry would cache None as a loaded
+    # model, and detection would stay off until the idle timeout even after
+    # the model file is downloaded
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"MediaPipe model not found at {model_path}")
+    pool = DetectorPool(_create_detector)
+    # Warm one instance so load errors surface here and the size estimate is real
+    pool.release(pool.acquire())
+    print(f"✅ MediaPipe Face Detector pool ready (up to {pool.max_size} instances)")
+    return pool
+
+get_registry().register("face_detector", _load_detector_pool, unloader=lambda pool: pool.close())
+
+def _get_detector_pool() -> DetectorPool:
+    """Lazy-load the MediaPipe Face Detector pool on first use"""
+    return get_registry().get("face_detector")
 
 def base64_to_image(base64_string: str) -> np.ndarray:
     """Convert base64 string to RGB numpy array using PIL"""
@@ -46,10 +153,17 @@ def base64_to_image(base64_string: str) -> np.ndarray:
         base64_string = base64_string.split(',')[1]
     
     # Decode base64
-    image_bytes = base64.b64decode(base64_string)
-    
+    return bytes_to_image(base64.b64decode(base64_string))
+
+def bytes_to_image(image_bytes: bytes) -> np.ndarray:
+    """Convert encoded image bytes (JPEG, PNG, ...) to RGB numpy array using PIL"""
     # Convert to PIL Image
-    pil_image = Image.open(io.BytesIO(image_bytes))
+    _ensure_image_plugins()
+    try:
+        pil_image = Image.open(io.BytesIO(image_bytes), formats=IMAGE_FORMATS)
+    except UnidentifiedImageError:
+        # Rarer formats (TIFF, ...): PIL registers every plugin on first use
+        pil_image = Image.open(io.BytesIO(image_bytes))
     
     # Ensure RGB
     if pil_image.mode != "RGB":
@@ -63,17 +177,20 @@ def detect_face(image: np.ndarray) -> Tuple[bool, float, Optional[dict]]:
     Detect face in image using MediaPipe Tasks
     Returns: (face_detected, confidence, bounding_box)
     """
-    detector = _get_detector()
-    if detector is None:
+    try:
+        pool = _get_detector_pool()
+    except FileNotFoundError as e:
+        # Checked again on the next call, so dropping the model in place enables detection
+        print(f"⚠️ {e}. Face detection will be limited.")
         return False, 0.0, None
 
-    vision = _get_mp_vision()
     import mediapipe as mp
     # MediaPipe Tasks expects mp.Image
     mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=image)
     
-    # Process detection
-    detection_result = detector.detect(mp_image)
+    # Process detection on a detector no other thread is using
+    with pool.checkout() as detector:
+        detection_result = detector.detect(mp_image)
     
     if not detection_result.detections:
         return False, 0.0, None
@@ -126,12 +243,57 @@ def preprocess_face(face: np.ndarray, target_size: Tuple[int, int] = (160, 160))
     
     return face_normalized
 
+def quality_gate(image: np.ndarray, bbox: dict) -> Tuple[bool, Optional[str], dict]:
+    """
+    Fast frame quality check on a downsampled uint8 luma of the face box
+    Returns: (passed, rejection_reason, metrics)
+
+    Rejection reasons: 'face_too_small', 'dark', 'overexposed', 'blur'.
+    Costs a fraction of a millisecond, so bad frames never reach the models.
+    """
+    x, y, w, h = bbox['x'], bbox['y'], bbox['width'], bbox['height']
+    metrics = {'faceSize': int(min(w, h))}
+    if min(w, h) < QUALITY_GATE_MIN_FACE_PX:
+        return False, 'face_too_small', metrics
+
+    ih, iw = image.shape[:2]
+    x1, y1 = max(0, x), max(0, y)
+    x2, y2 = min(iw, x + w), min(ih, y + h)
+    # Strided view: no copy of the full-resolution crop
+    step = max(1, min(y2 - y1, x2 - x1) // QUALITY_GATE_SAMPLE_PX)
+    sample = image[y1:y2:step, x1:x2:step]
+
+    # Integer BT.601 luma: (77 R + 150 G + 29 B) >> 8
+    sample = sample.astype(np.uint16)
+    if sample.ndim == 3:
+        luma = (sample[..., 0] * 77 + sample[..., 1] * 150 + sample[..., 2] * 29) >> 8
+    else:
+        luma = sample
+    luma = luma.astype(np.int16)
+
+    brightness = float(luma.mean(dtype=np.float32))
+    metrics['brightness'] = brightness
+    if brightness < QUALITY_GATE_MIN_BRIGHTNESS:
+        return False, 'dark', metrics
+    if brightness > QUALITY_GATE_MAX_BRIGHTNESS:
+        return False, 'overexposed', metrics
+
+    # 4-neighbour Laplacian in int16 (|value| <= 1020)
+    lap = (luma[:-2, 1:-1] + luma[2:, 1:-1] + luma[1:-1, :-2] + luma[1:-1, 2:]
+           - 4 * luma[1:-1, 1:-1])
+    sharpness = float(lap.var(dtype=np.float32)) if lap.size else 0.0
+    metrics['sharpness'] = sharpness
+    if sharpness < QUALITY_GATE_MIN_SHARPNESS:
+        return False, 'blur', metrics
+
+    return True, None, metrics
+
 def calculate_image_quality(image: np.ndarray) -> float:
     """Calculate image quality score without OpenCV"""
     # Convert to grayscale via luminosity formula
     # gray = 0.2989 R + 0.5870 G + 0.1140 B
     if len(image.shape) == 3:
-        gray = np.dot(image[...,:3], [0.2989, 0.5870, 0.1140])
+        gray = image[..., :3] @ _LUMA_WEIGHTS
     else:
         gray = image
 
@@ -0,0 +1,97 @@
+import numpy as np
+import threading
+from typing import Dict, List, Optional, Tuple
+
+EMBEDDING_DIM = 512
+
+
+class EmbeddingGallery:
+    """In-memory store of enrolled face embeddings for top-k identification"""
+
+    def __init__(self, dim: int = EMBEDDING_DIM, initial_capacity: int = 1024):
+        self.dim = dim
+        self._matrix = np.zeros((initial_capacity, dim), dtype=np.float32)
+        self._ids: List[str] = []
+        self._index: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _normalize(self, embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dimensional embedding, got {vector.shape[0]}")
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector = vector / norm
+        return vector
+
+    def add(self, user_id: str, embedding) -> None:
+        """Enroll or replace the embedding stored for user_id"""
+        vector = self._normalize(embedding)
+        with self._lock:
+            row = self._index.get(user_id)
+            if row is None:
+                row = len(self._ids)
+                if row == self._matrix.shape[0]:
+                    # Grow geometrically so bulk enrollment stays amortized O(1)
+                    grown = np.zeros((row * 2, self.dim), dtype=np.float32)
+                    grown[:row] = self._matrix
+                    self._matrix = grown
+                self._ids.append(user_id)
+                self._index[user_id] = row
+            self._matrix[row] = vector
+
+    def remove(self, user_id: str) -> bool:
+        """Remove user_id, back-filling its row with the last entry"""
+        with self._lock:
+            row = self._index.pop(user_id, None)
+            if row is None:
+                return False
+            last = len(self._ids) - 1
+            if row != last:
+                moved_id = self._ids[last]
+                self._matrix[row] = self._matrix[last]
+                self._ids[row] = moved_id
+                self._index[moved_id] = row
+            self._ids.pop()
+            return True
+
+    def get(self, user_id: str) -> Optional[np.ndarray]:
+        """Stored (normalized) embedding for user_id, or None"""
+        with self._lock:
+            row = self._index.get(user_id)
+            return None if row is None else self._matrix[row].copy()
+
+    def search(self, embedding, top_k: int = 5) -> List[Tuple[str, float]]:
+        """Return up to top_k (user_id, cosine similarity) pairs, best first"""
+        query = self._normalize(embedding)
+        with self._lock:
+            size = len(self._ids)
+            if size == 0 or top_k <= 0:
+                return []
+            scores = self._matrix[:size] @ query
+            k = min(top_k, size)
+            if k < size:
+                candidates = np.argpartition(-scores, k - 1)[:k]
+            else:
+                candidates = np.arange(size)
+            ordered = candidates[np.argsort(-scores[candidates])]
+            return [(self._ids[i], float(scores[i])) for i in ordered]
+
+    def entries(self) -> List[Tuple[str, np.ndarray]]:
+        """Snapshot of all (user_id, embedding) pairs, used for rebalancing"""
+        with self._lock:
+            return [(user_id, self._matrix[i].copy()) for i, user_id in enumerate(self._ids)]
+
+
+# Global gallery instance
+_gallery = None
+
+def get_gallery() -> EmbeddingGallery:
+    """Get or create the singleton gallery instance"""
+    global _gallery
+    if _gallery is None:
+        _gallery = EmbeddingGallery()
+    return _gallery
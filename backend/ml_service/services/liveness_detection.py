@@ -1,80 +1,330 @@
-import torch
-import torch.nn.functional as F
 import numpy as np
-from PIL import Image
 import os
 import sys
+import threading
+import time
+from typing import List, Optional, Tuple
 
 # Add models directory to path so we can import MiniFASNet/MultiFTNet
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from models.anti_spoof.MultiFTNet import MultiFTNet
+from services.preprocessing import get_preprocessor
+from services.model_registry import get_registry
+from services.timing import stage
+from services.execution_plan import configure_torch
+
+# NOTE: torch and the anti-spoof architectures are NOT imported at module level
+# so importing this module (and main) stays cheap; they load with the first
+# AntiSpoofPredictor, i.e. when the registry first loads "anti_spoof".
+
+ANTI_SPOOF_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "models", "anti_spoof")
+
+# Comma-separated "checkpoint[:weight]" list; the checkpoint name encodes
+# crop scale, input size and architecture, e.g. 2.7_80x80_MiniFASNetV2.pth
+ANTI_SPOOF_MODELS = os.environ.get("ANTI_SPOOF_MODELS", "2.7_80x80_MiniFASNetV2.pth:1.0")
+LIVENESS_THRESHOLD = float(os.environ.get("LIVENESS_THRESHOLD", "0.5"))
+# Fold BatchNorm, go channels-last and freeze with TorchScript after loading
+ANTI_SPOOF_OPTIMIZE = os.environ.get("ANTI_SPOOF_OPTIMIZE", "true").lower() != "false"
+# Concurrent liveness calls are run as one forward pass per checkpoint: a call
+# waits up to this long for others that are still cropping (0 disables)
+LIVENESS_BATCH_WINDOW_MS = float(os.environ.get("LIVENESS_BATCH_WINDOW_MS", "5"))
+LIVENESS_MAX_BATCH = int(os.environ.get("LIVENESS_MAX_BATCH", "16"))
+
+# Architectures that can be named in a checkpoint file (see models/anti_spoof/MiniFASNet.py)
+MODEL_TYPES = ('MiniFASNetV1', 'MiniFASNetV2', 'MiniFASNetV1SE', 'MiniFASNetV2SE')
+
+
+def parse_model_name(model_name: str) -> Tuple[Optional[float], int, int, str]:
+    """
+    Parse Silent-Face checkpoint names
+    Returns: (scale or None for full frame, input_height, input_width, model_type)
+    """
+    info = model_name.split('_')[0:-1]
+    h_input, w_input = info[-1].split('x')
+    model_type = model_name.split('.pth')[0].split('_')[-1]
+    scale = None if info[0] == "org" else float(info[0])
+    return scale, int(h_input), int(w_input), model_type
+
+
+def crop_scaled_face(image: np.ndarray, bbox: dict, scale: Optional[float]) -> np.ndarray:
+    """
+    Crop a square-ish box of scale x the face box, shifted to stay inside the frame
+
+    Mirrors Silent-Face's CropImage; returns a view (no copy). scale=None
+    returns the whole frame.
+    """
+    if scale is None:
+        return image
+    src_h, src_w = image.shape[:2]
+    x, y, box_w, box_h = bbox['x'], bbox['y'], bbox['width'], bbox['height']
+    scale = min((src_h - 1) / box_h, (src_w - 1) / box_w, scale)
+
+    new_w, new_h = box_w * scale, box_h * scale
+    center_x, center_y = box_w / 2 + x, box_h / 2 + y
+    x1, y1 = center_x - new_w / 2, center_y - new_h / 2
+    x2, y2 = center_x + new_w / 2, center_y + new_h / 2
+
+    if x1 < 0:
+        x2 -= x1
+        x1 = 0
+    if y1 < 0:
+        y2 -= y1
+        y1 = 0
+    if x2 > src_w - 1:
+        x1 -= x2 - src_w + 1
+        x2 = src_w - 1
+    if y2 > src_h - 1:
+        y1 -= y2 - src_h + 1
+        y2 = src_h - 1
+
+    return image[int(y1):int(y2) + 1, int(x1):int(x2) + 1]
+
 
 class AntiSpoofPredictor:
-    def __init__(self, model_path):
+    """One MiniFASNet checkpoint plus the crop geometry it was trained on"""
+
+    def __init__(self, model_path, scale: Optional[float] = None, optimize: bool = ANTI_SPOOF_OPTIMIZE):
+        import torch
+        from models.anti_spoof import MiniFASNet
+        from models.anti_spoof.MultiFTNet import MultiFTNet
+        from models.anti_spoof.inference import build_inference_model
+
+        configure_torch(torch)
+        self._torch = torch
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.model = MultiFTNet(num_classes=3).to(self.device)
-        
-        # Load weights
-        state_dict = torch.load(model_path, map_user=self.device)
-        self.model.load_state_dict(state_dict)
-        self.model.eval()
-        print(f"✅ Anti-Spoof Model loaded on {self.device}")
-
-    def predict(self, face_image: np.ndarray):
+        self.name = os.path.basename(model_path)
+        name_scale, h_input, w_input, model_type = parse_model_name(self.name)
+        self.scale = name_scale if scale is None else scale
+        self.input_size = (w_input, h_input)
+
+        # Load weights (checkpoints were saved from nn.DataParallel)
+        state_dict = torch.load(model_path, map_location=self.device)
+        state_dict = {k[len('module.'):] if k.startswith('module.') else k: v
+                      for k, v in state_dict.items()}
+
+        kernel_size = ((h_input + 15) // 16, (w_input + 15) // 16)
+        if any(k.startswith('FTGenerator.') for k in state_dict):
+            # Training checkpoint with the auxiliary Fourier-transform branch
+            model = MultiFTNet(num_classes=3, conv6_kernel=kernel_size)
+        else:
+            if model_type not in MODEL_TYPES:
+                raise ValueError(f"Unknown anti-spoof architecture: {model_type}")
+            model = getattr(MiniFASNet, model_type)(conv6_kernel=kernel_size)
+        model.load_state_dict(state_dict)
+        model.eval()
+
+        self.optimized = optimize and self.device.type == "cpu"
+        if self.optimized:
+            self.model = build_inference_model(model, self.input_size)
+        else:
+            self.model = model.to(self.device)
+        print(f"✅ Anti-Spoof Model {self.name} loaded on {self.device}"
+              f"{' (folded, frozen)' if self.optimized else ''}")
+
+    def predict_batch(self, face_batch: np.ndarray) -> np.ndarray:
         """
-        Inference using strictly PIL and PyTorch (No OpenCV)
-        face_image: RGB numpy array
+        Class probabilities for a batch of preprocessed faces
+        face_batch: NCHW float32 (N x 3 x H x W, BGR, values in [0, 255])
+        Returns: N x 3 array of [Fake, Real, Unknown] probabilities
         """
-        # 1. Resize to 80x80 (required by MiniFASNetV2)
-        img = Image.fromarray(face_image)
-        img = img.resize((80, 80), Image.BILINEAR)
-        
-        # 2. Convert to Tensor and Normalize
-        img_tensor = torch.from_numpy(np.array(img)).permute(2, 0, 1).float()
-        img_tensor = img_tensor.unsqueeze(0).to(self.device)
-        
-        # 3. Inference
+        torch = self._torch
+        img_tensor = torch.from_numpy(face_batch).to(self.device)
+        if self.optimized:
+            img_tensor = img_tensor.contiguous(memory_format=torch.channels_last)
         with torch.no_grad():
             outputs = self.model(img_tensor)
             # MiniFASNet outputs 3 classes: [Fake, Real, Unknown]
-            probs = F.softmax(outputs, dim=1)
-            
-        # Logging raw probabilities for tuning
-        print(f"📊 Model Probs: Fake={probs[0][0]:.3f}, Real={probs[0][1]:.3f}, Unknown={probs[0][2]:.3f}")
-            
-        # Class 1 is "Real". Lowering threshold to 0.5 for better human acceptance.
-        score = probs[0][1].item()
-        is_live = score > 0.5 # Relaxed threshold
-        
-        return is_live, score
-
-_predictor = None
-
-def get_anti_spoof_predictor():
-    global _predictor
-    if _predictor is None:
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        model_file = os.path.join(current_dir, "..", "models", "anti_spoof", "2.7_80x80_MiniFASNetV2.pth")
+            probs = torch.softmax(outputs, dim=1)
+        return probs.cpu().numpy()
+
+
+class LivenessEngine:
+    """Runs one or more anti-spoof checkpoints at their own crop scales and fuses scores"""
+
+    def __init__(self, predictors: List[Tuple[AntiSpoofPredictor, float]]):
+        if not predictors:
+            raise ValueError("LivenessEngine needs at least one model")
+        self.predictors = predictors
+        self.total_weight = sum(weight for _, weight in predictors)
+
+    def prepare(self, image: np.ndarray, bboxes: List[dict]) -> List[np.ndarray]:
+        """Crop and preprocess every face in one frame; one NCHW batch per checkpoint"""
+        preprocessor = get_preprocessor()
+        batches = []
+        for predictor, _ in self.predictors:
+            with stage("crop"):
+                crops = [crop_scaled_face(image, bbox, predictor.scale) for bbox in bboxes]
+            with stage("preprocess"):
+                batches.append(preprocessor.prepare_batch(crops, predictor.input_size, bgr=True))
+        return batches
+
+    def infer(self, batches: List[np.ndarray]) -> np.ndarray:
+        """
+        Fused class probabilities for batches from prepare() (possibly concatenated across frames)
+        Returns: N x 3 array of weighted-mean [Fake, Real, Unknown] probabilities
+        """
+        fused = np.zeros((len(batches[0]), 3), dtype=np.float32)
+        for (predictor, weight), batch in zip(self.predictors, batches):
+            fused += weight * predictor.predict_batch(batch)
+        fused /= self.total_weight
+        return fused
+
+    def predict(self, image: np.ndarray, bboxes: List[dict]) -> np.ndarray:
+        """Fused class probabilities for every face in one frame"""
+        batches = self.prepare(image, bboxes)
+        with stage("liveness"):
+            return self.infer(batches)
+
+
+class _PendingBatch:
+    def __init__(self, engine: LivenessEngine):
+        self.engine = engine
+        self.parts: List[List[np.ndarray]] = []
+        self.size = 0
+        self.result: Optional[np.ndarray] = None
+        self.error: Optional[BaseException] = None
+        self.done = threading.Event()
+
+
+class LivenessBatcher:
+    """
+    Coalesces concurrent liveness calls into one forward pass per checkpoint
+
+    Each caller crops and preprocesses its own frame, then joins the open
+    batch. The caller that opened it waits until every call still preparing
+    has joined, the batch holds max_batch faces, or window seconds pass, then
+    runs the models once for all of them. A lone call never waits, so this
+    costs nothing in process mode, where each worker runs one task at a time.
+    """
+
+    def __init__(self, window: float = LIVENESS_BATCH_WINDOW_MS / 1000, max_batch: int = LIVENESS_MAX_BATCH):
+        self.window = window
+        self.max_batch = max_batch
+        self._cond = threading.Condition()
+        self._open: Optional[_PendingBatch] = None
+        self._preparing = 0
+        self.counters = {"calls": 0, "forwards": 0}
+
+    def predict(self, engine: LivenessEngine, image: np.ndarray, bboxes: List[dict]) -> np.ndarray:
+        if self.window <= 0:
+            return engine.predict(image, bboxes)
+
+        with self._cond:
+            self._preparing += 1
+        try:
+            parts = engine.prepare(image, bboxes)
+        finally:
+            with self._cond:
+                self._preparing -= 1
+                self._cond.notify_all()
+
+        with self._cond:
+            self.counters["calls"] += 1
+            batch = self._open
+            leader = (batch is None or batch.engine is not engine
+                      or batch.size + len(bboxes) > self.max_batch)
+            if leader:
+                batch = self._open = _PendingBatch(engine)
+            start = batch.size
+            batch.parts.append(parts)
+            batch.size += len(bboxes)
+            self._cond.notify_all()
+            if leader:
+                deadline = time.monotonic() + self.window
+                while (self._open is batch and self._preparing > 0
+                       and batch.size < self.max_batch):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._open is batch:
+                    self._open = None
+                self.counters["forwards"] += 1
+
+        with stage("liveness"):
+            if leader:
+                try:
+                    batches = batch.parts[0] if len(batch.parts) == 1 else [
+                        np.concatenate(per_model) for per_model in zip(*batch.parts)
+                    ]
+                    batch.result = engine.infer(batches)
+                except BaseException as e:
+                    batch.error = e
+                finally:
+                    batch.done.set()
+            else:
+                batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        return batch.result[start:start + len(bboxes)]
+
+    def metrics(self) -> dict:
+        calls, forwards = self.counters["calls"], self.counters["forwards"]
+        return {**self.counters, "avgBatch": round(calls / forwards, 2) if forwards else None}
+
+
+def parse_model_specs(specs: str) -> List[Tuple[str, float]]:
+    """Parse "a.pth:1.0,b.pth:0.5" into [(file, weight), ...]"""
+    parsed = []
+    for spec in specs.split(','):
+        spec = spec.strip()
+        if not spec:
+            continue
+        name, _, weight = spec.partition(':')
+        parsed.append((name, float(weight) if weight else 1.0))
+    return parsed
+
+
+def _load_liveness_engine() -> LivenessEngine:
+    predictors = []
+    for name, weight in parse_model_specs(ANTI_SPOOF_MODELS):
+        model_file = os.path.join(ANTI_SPOOF_DIR, name)
         if not os.path.exists(model_file):
-            raise FileNotFoundError(f"Anti-spoof weights not found at {model_file}")
-        _predictor = AntiSpoofPredictor(model_file)
-    return _predictor
+            print(f"⚠️ Anti-spoof weights not found at {model_file}, skipping")
+            continue
+        predictors.append((AntiSpoofPredictor(model_file), weight))
+    if not predictors:
+        raise FileNotFoundError(f"No anti-spoof weights found for ANTI_SPOOF_MODELS={ANTI_SPOOF_MODELS}")
+    return LivenessEngine(predictors)
+
+get_registry().register("anti_spoof", _load_liveness_engine)
+
+def get_liveness_engine() -> LivenessEngine:
+    """Get the liveness engine, loading (or reloading) it only when needed"""
+    return get_registry().get("anti_spoof")
+
+_batcher = None
+
+def get_liveness_batcher() -> LivenessBatcher:
+    """Get or create the singleton liveness batcher"""
+    global _batcher
+    if _batcher is None:
+        _batcher = LivenessBatcher()
+    return _batcher
 
-def check_liveness_advanced(image: np.ndarray, session_id: str = "default"):
+def check_liveness_advanced(image: np.ndarray, bbox: dict, session_id: str = "default"):
     """
     New Deep Learning Liveness Detection
+
+    image: full RGB frame; crops are taken per checkpoint scale around bbox
     """
     try:
-        predictor = get_anti_spoof_predictor()
-        is_live, score = predictor.predict(image)
-        
+        engine = get_liveness_engine()
+        probs = get_liveness_batcher().predict(engine, image, [bbox])[0]
+
+        # Logging raw probabilities for tuning
+        print(f"📊 Model Probs: Fake={probs[0]:.3f}, Real={probs[1]:.3f}, Unknown={probs[2]:.3f}")
+
+        # Class 1 is "Real". Lowering threshold to 0.5 for better human acceptance.
+        score = float(probs[1])
+        is_live = score > LIVENESS_THRESHOLD
+
         print(f"🤖 DL Anti-Spoof | Result: {'LIVE' if is_live else 'SPOOF'} (Score: {score:.2f})")
-        
+
         return {
             'isLive': is_live,
-            'score': float(score),
+            'score': score,
             'lowLight': False, # DL model is robust, heuristics not needed
-            'metrics': {'dl_confidence': float(score)}
+            'metrics': {'dl_confidence': score}
         }
     except Exception as e:
         print(f"❌ DL Liveness Error: {e}")
@@ -0,0 +1,177 @@
+import gc
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+# Unload models that have not been used for this long (0 disables)
+MODEL_IDLE_TIMEOUT_SECONDS = float(os.environ.get("MODEL_IDLE_TIMEOUT_SECONDS", "900"))
+# Evict least-recently-used models while process RSS exceeds this (0 disables)
+MODEL_RSS_BUDGET_MB = float(os.environ.get("MODEL_RSS_BUDGET_MB", "0"))
+# How often the background reaper checks idle time and the RSS budget
+MODEL_REAPER_INTERVAL_SECONDS = float(os.environ.get("MODEL_REAPER_INTERVAL_SECONDS", "30"))
+
+
+def current_rss_bytes() -> int:
+    """Resident set size of this process (Linux /proc, falls back to peak RSS)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _release_memory():
+    """Collect garbage and hand freed heap pages back to the OS"""
+    gc.collect()
+    try:
+        import ctypes
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+class _Entry:
+    def __init__(self, loader: Callable[[], Any], unloader: Optional[Callable[[Any], None]]):
+        self.loader = loader
+        self.unloader = unloader
+        self.instance = None
+        self.loaded = False
+        self.last_used = 0.0
+        self.size_bytes = 0
+        self.loads = 0
+        self.unloads = 0
+        self.last_load_ms = 0.0
+        self.total_reload_ms = 0.0
+        self.lock = threading.Lock()
+
+
+class ModelRegistry:
+    """
+    Tracks the heavy models this service keeps resident
+
+    Models are loaded on first get(), unloaded after MODEL_IDLE_TIMEOUT_SECONDS
+    without use, and evicted least-recently-used first while the process RSS
+    is above MODEL_RSS_BUDGET_MB. An evicted model reloads on its next get();
+    the reload latency is reported by metrics().
+    """
+
+    def __init__(self, idle_timeout: float = MODEL_IDLE_TIMEOUT_SECONDS,
+                 rss_budget_bytes: int = int(MODEL_RSS_BUDGET_MB * 1024 * 1024)):
+        self.idle_timeout = idle_timeout
+        self.rss_budget_bytes = rss_budget_bytes
+        self._entries: Dict[str, _Entry] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, loader: Callable[[], Any],
+                 unloader: Optional[Callable[[Any], None]] = None) -> None:
+        """Register a model; unloader (if given) releases native resources on eviction"""
+        with self._lock:
+            if name not in self._entries:
+                self._entries[name] = _Entry(loader, unloader)
+
+    def get(self, name: str) -> Any:
+        entry = self._entries[name]
+        with entry.lock:
+            entry.last_used = time.monotonic()
+            if not entry.loaded:
+                rss_before = current_rss_bytes()
+                start = time.perf_counter()
+                entry.instance = entry.loader()
+                entry.last_load_ms = (time.perf_counter() - start) * 1000
+                entry.size_bytes = max(0, current_rss_bytes() - rss_before)
+                if entry.loads > 0:
+                    entry.total_reload_ms += entry.last_load_ms
+                    print(f"♻️ Reloaded {name} in {entry.last_load_ms:.0f} ms")
+                entry.loads += 1
+                entry.loaded = True
+            instance = entry.instance
+
+        self.enforce_budget(keep=name)
+        return instance
+
+    def unload(self, name: str) -> bool:
+        entry = self._entries[name]
+        with entry.lock:
+            if not entry.loaded:
+                return False
+            if entry.unloader is not None and entry.instance is not None:
+                entry.unloader(entry.instance)
+            entry.instance = None
+            entry.loaded = False
+            entry.unloads += 1
+        _release_memory()
+        print(f"💤 Unloaded {name} (~{entry.size_bytes / 1024 / 1024:.0f} MB)")
+        return True
+
+    def evict_idle(self) -> int:
+        if self.idle_timeout <= 0:
+            return 0
+        now = time.monotonic()
+        idle = [name for name, e in self._entries.items()
+                if e.loaded and now - e.last_used > self.idle_timeout]
+        return sum(1 for name in idle if self.unload(name))
+
+    def enforce_budget(self, keep: Optional[str] = None) -> int:
+        """
+        Evict least-recently-used models (except keep) until RSS fits the budget
+
+        Nothing is evicted unless the tracked sizes of the candidates can cover
+        the overshoot, and eviction stops at the first unload that does not
+        lower RSS (that model's size is corrected to what it really freed).
+        Otherwise a runtime that alone exceeds the budget would make every
+        get() evict, and later reload, every other model.
+        """
+        if self.rss_budget_bytes <= 0:
+            return 0
+        evicted = 0
+        rss = current_rss_bytes()
+        while rss > self.rss_budget_bytes:
+            candidates = [(e.last_used, name) for name, e in self._entries.items()
+                          if e.loaded and name != keep and e.size_bytes > 0]
+            if sum(self._entries[name].size_bytes for _, name in candidates) < rss - self.rss_budget_bytes:
+                break
+            _, victim = min(candidates)
+            if not self.unload(victim):
+                break
+            evicted += 1
+            freed = rss - current_rss_bytes()
+            rss -= freed
+            if freed <= 0:
+                self._entries[victim].size_bytes = 0
+                print(f"⚠️ Unloading {victim} freed no memory; RSS budget cannot be met by eviction")
+                break
+            self._entries[victim].size_bytes = min(self._entries[victim].size_bytes, freed)
+        return evicted
+
+    def metrics(self) -> dict:
+        now = time.monotonic()
+        models = {}
+        for name, e in self._entries.items():
+            reloads = max(0, e.loads - 1)
+            models[name] = {
+                "loaded": e.loaded,
+                "approxSizeMB": round(e.size_bytes / 1024 / 1024, 1),
+                "idleSeconds": round(now - e.last_used, 1) if e.loads else None,
+                "loads": e.loads,
+                "unloads": e.unloads,
+                "lastLoadMs": round(e.last_load_ms, 1),
+                "avgReloadMs": round(e.total_reload_ms / reloads, 1) if reloads else None,
+            }
+        return {
+            "rssMB": round(current_rss_bytes() / 1024 / 1024, 1),
+            "rssBudgetMB": round(self.rss_budget_bytes / 1024 / 1024, 1) or None,
+            "idleTimeoutSeconds": self.idle_timeout or None,
+            "models": models,
+        }
+
+
+_registry = None
+
+def get_registry() -> ModelRegistry:
+    """Get or create the singleton model registry"""
+    global _registry
+    if _registry is None:
+        _registry = ModelRegistry()
+    return _registry
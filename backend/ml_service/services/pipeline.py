@@ -0,0 +1,170 @@
+import numpy as np
+from typing import Callable, List, Optional, Tuple
+
+from services.face_detection import (
+    detect_face,
+    extract_face_region,
+    calculate_image_quality,
+    quality_gate,
+    QUALITY_GATE_ENABLED
+)
+from services.preprocessing import get_preprocessor
+from services.timing import stage
+from services.liveness_detection import check_liveness_advanced as check_liveness
+from models.face_recognition import get_model
+
+# Per-request inference pipelines on a decoded RGB frame. They only return
+# small, picklable results so they can run in the request thread pool or in
+# a worker process (services/process_pool.py).
+
+
+class PipelineError(Exception):
+    """Request-level failure that maps to an HTTP status (picklable)"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def classify_similarity(similarity: float):
+    """Step 14 thresholds: (match, 'high' | 'medium' | 'low')"""
+    if similarity >= 0.85:
+        return True, "high"
+    if similarity >= 0.70:
+        return True, "medium"
+    return False, "low"
+
+
+def detect(image: np.ndarray) -> dict:
+    """Step 12: Face Detection & Preprocessing"""
+    with stage("detect"):
+        face_detected, confidence, bbox = detect_face(image)
+    return {
+        "faceDetected": face_detected,
+        "confidence": confidence,
+        "boundingBox": bbox
+    }
+
+
+def crop_face(image: np.ndarray) -> Tuple[np.ndarray, float]:
+    """
+    Detect, quality-gate and crop the face to embed
+
+    Returns: (face_region, quality); raises PipelineError for unusable frames
+    """
+    with stage("detect"):
+        face_detected, confidence, bbox = detect_face(image)
+
+    if not face_detected or confidence < 0.5:
+        raise PipelineError(400, "No face detected or confidence too low")
+
+    # Reject unusable frames before running any model
+    if QUALITY_GATE_ENABLED:
+        with stage("gate"):
+            passed, reason, _ = quality_gate(image, bbox)
+        if not passed:
+            raise PipelineError(400, f"Frame rejected by quality gate: {reason}")
+
+    # Extract face region
+    with stage("crop"):
+        face_region = extract_face_region(image, bbox)
+
+    # Calculate quality
+    with stage("quality"):
+        quality = calculate_image_quality(face_region)
+
+    return face_region, quality
+
+
+def embed(image: np.ndarray) -> dict:
+    """Step 13: Generate Face Embeddings"""
+    face_region, quality = crop_face(image)
+
+    # Preprocess straight into the reusable NCHW batch buffer
+    with stage("preprocess"):
+        face_batch = get_preprocessor().prepare([face_region])
+
+    # Generate embedding
+    model = get_model()
+    with stage("embed"):
+        embedding = model.generate_embeddings(face_batch)[0]
+
+    return {
+        "embedding": embedding.tolist(),
+        "quality": quality
+    }
+
+
+def liveness(image: np.ndarray, session_id: str = "default") -> dict:
+    """Verify if the person in the image is real"""
+    with stage("detect"):
+        face_detected, confidence, bbox = detect_face(image)
+
+    if not face_detected:
+        return {
+            "faceDetected": False,
+            "isLive": False,
+            "score": 0.0
+        }
+
+    # Reject unusable frames before running the anti-spoof model
+    if QUALITY_GATE_ENABLED:
+        with stage("gate"):
+            passed, reason, gate_metrics = quality_gate(image, bbox)
+        if not passed:
+            return {
+                "faceDetected": True,
+                "isLive": False,
+                "score": 0.0,
+                "lowLight": reason == "dark",
+                "rejected": reason,
+                "metrics": gate_metrics
+            }
+
+    # Check liveness (crops at each anti-spoof checkpoint's scale around bbox;
+    # the engine records its own crop / preprocess / liveness stages)
+    liveness_result = check_liveness(image, bbox, session_id=session_id)
+
+    return {
+        "faceDetected": True,
+        "isLive": liveness_result['isLive'],
+        "score": liveness_result['score'],
+        "lowLight": liveness_result['lowLight'],
+        "metrics": liveness_result['metrics']
+    }
+
+
+def embed_many(images: List[np.ndarray], yield_to: Optional[Callable[[], None]] = None,
+               forward_batch: int = 0) -> List[dict]:
+    """
+    Batched Step 13 for bulk jobs: detect and gate every frame, then run
+    FaceNet on the accepted faces, forward_batch at a time (0 = all at once)
+
+    yield_to, if given, is called before every detection and every FaceNet
+    forward so bulk callers can pause for interactive requests.
+    Returns one dict per image: {"embedding", "quality"} or {"error"}.
+    """
+    results: List[dict] = [{} for _ in images]
+    crops, accepted = [], []
+    for i, image in enumerate(images):
+        if yield_to is not None:
+            yield_to()
+        try:
+            face_region, quality = crop_face(image)
+        except PipelineError as e:
+            results[i] = {"error": e.detail}
+            continue
+        results[i] = {"quality": quality}
+        crops.append(face_region)
+        accepted.append(i)
+
+    step = forward_batch or len(crops)
+    for start in range(0, len(crops), step):
+        if yield_to is not None:
+            yield_to()
+        face_batch = get_preprocessor().prepare(crops[start:start + step])
+        embeddings = get_model().generate_embeddings(face_batch)
+        for i, embedding in zip(accepted[start:start + step], embeddings):
+            results[i]["embedding"] = embedding.tolist()
+    return results
@@ -0,0 +1,93 @@
+import numpy as np
+import threading
+from PIL import Image
+from typing import List, Tuple
+
+# FaceNet input geometry, values in [0, 1]
+EMBEDDING_SIZE = (160, 160)
+
+# Crops larger than REDUCING_GAP x the embedding size are box-reduced once
+# (PIL C code) before the final resample.
+REDUCING_GAP = 3
+
+
+class FacePreprocessor:
+    """
+    Single preprocessing stage for the embedding and liveness models
+
+    prepare() turns face crops into the FaceNet batch; prepare_batch()
+    resizes the per-checkpoint anti-spoof crops to each model's input size.
+    Output is written into preallocated buffers that are reused across
+    calls, so the returned arrays are only valid until the next call for
+    the same size on the same instance (use get_preprocessor() per thread).
+    """
+
+    def __init__(self, max_batch: int = 8):
+        self._max_batch = max_batch
+        self._buffers = {}
+
+    def _buffer(self, size: Tuple[int, int], batch: int) -> np.ndarray:
+        """Reusable NCHW buffer for (width, height), grown only when needed"""
+        buf = self._buffers.get(size)
+        if buf is None or buf.shape[0] < batch:
+            buf = np.empty((max(batch, self._max_batch), 3, size[1], size[0]), dtype=np.float32)
+            self._buffers[size] = buf
+        return buf
+
+    @staticmethod
+    def _resize_into(image: Image.Image, size: Tuple[int, int], resample, scale: float,
+                     out: np.ndarray, bgr: bool = False):
+        """Resample and write HWC uint8 -> scaled CHW float32 in one pass"""
+        if image.size != size:
+            image = image.resize(size, resample)
+        hwc = np.asarray(image)
+        np.multiply(hwc.transpose(2, 0, 1), np.float32(scale), out=out[::-1] if bgr else out)
+
+    @staticmethod
+    def _to_image(crop: np.ndarray) -> Image.Image:
+        image = Image.fromarray(crop)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        factor = min(image.size) // (REDUCING_GAP * EMBEDDING_SIZE[0])
+        if factor >= 2:
+            image = image.reduce(factor)
+        return image
+
+    def prepare(self, crops: List[np.ndarray]) -> np.ndarray:
+        """
+        Preprocess face crops for FaceNet
+
+        Returns: embedding batch [N,3,160,160], values in [0, 1]
+        """
+        n = len(crops)
+        buf = self._buffer(EMBEDDING_SIZE, n)
+        for i, crop in enumerate(crops):
+            self._resize_into(self._to_image(crop), EMBEDDING_SIZE, Image.Resampling.LANCZOS,
+                              1.0 / 255.0, buf[i])
+        return buf[:n]
+
+    def prepare_batch(self, crops: List[np.ndarray], size: Tuple[int, int],
+                      resample=Image.Resampling.BILINEAR, scale: float = 1.0,
+                      bgr: bool = False) -> np.ndarray:
+        """
+        Resize crops to an arbitrary (width, height) NCHW float32 batch
+
+        bgr=True writes channels in BGR order (the Silent-Face checkpoints
+        were trained on OpenCV frames).
+        """
+        n = len(crops)
+        buf = self._buffer(size, n)
+        for i, crop in enumerate(crops):
+            self._resize_into(Image.fromarray(crop), size, resample, scale, buf[i], bgr=bgr)
+        return buf[:n]
+
+
+_local = threading.local()
+
+def get_preprocessor() -> FacePreprocessor:
+    """Get the calling thread's preprocessor (buffers are not shared across threads)"""
+    preprocessor = getattr(_local, "preprocessor", None)
+    if preprocessor is None:
+        preprocessor = FacePreprocessor()
+        _local.preprocessor = preprocessor
+    return preprocessor
@@ -0,0 +1,184 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Dict, Optional
+
+import numpy as np
+
+from services.timing import merge
+from services.execution_plan import get_execution_plan
+from services.model_registry import MODEL_REAPER_INTERVAL_SECONDS, get_registry
+
+# Process-pool execution mode: the event-loop process copies each decoded frame
+# into a slot of a shared-memory ring (one memcpy, no pickling); each worker
+# process attaches to the same block, runs services/pipeline.py on a zero-copy
+# view of its slot with its own models, and sends back only the small result.
+# Slots are recycled in place.
+
+INFERENCE_MODE = os.environ.get("INFERENCE_MODE", "thread")  # "thread" or "process"
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", "0"))  # 0 = execution plan workers
+SHM_SLOT_MB = float(os.environ.get("SHM_SLOT_MB", "8"))  # 1920x1080 RGB is ~6 MB
+SHM_SLOTS = int(os.environ.get("SHM_SLOTS", "0"))  # 0 = 2 per worker
+
+
+class SharedFrameRing:
+    """Fixed-size slots in one shared-memory block, handed out from a free list"""
+
+    def __init__(self, slots: int, slot_bytes: int):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+        self._free: Optional[asyncio.Queue] = None
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def _free_slots(self) -> asyncio.Queue:
+        # Created lazily so it binds to the running event loop
+        if self._free is None:
+            self._free = asyncio.Queue()
+            for slot in range(self.slots):
+                self._free.put_nowait(slot)
+        return self._free
+
+    async def acquire(self) -> int:
+        """Wait for a free slot (backpressure when every slot is in flight)"""
+        return await self._free_slots().get()
+
+    def release(self, slot: int) -> None:
+        self._free_slots().put_nowait(slot)
+
+    def view(self, slot: int, shape, dtype=np.uint8) -> np.ndarray:
+        return slot_view(self.shm, self.slot_bytes, slot, shape, dtype)
+
+    def close(self) -> None:
+        self.shm.close()
+        self.shm.unlink()
+
+
+def slot_view(shm: shared_memory.SharedMemory, slot_bytes: int, slot: int, shape, dtype=np.uint8) -> np.ndarray:
+    return np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=slot * slot_bytes)
+
+
+# --- worker process side ---
+
+_worker_shm = None
+_worker_slot_bytes = 0
+
+def _worker_init(shm_name: str, slot_bytes: int):
+    global _worker_shm, _worker_slot_bytes
+    # Spawned workers share the parent's resource tracker, so attaching does
+    # not take ownership; the parent alone unlinks the block on shutdown
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_slot_bytes = slot_bytes
+    # Each worker loads its own models, so it also needs its own reaper
+    threading.Thread(target=_worker_reaper, daemon=True).start()
+    print(f"👷 Inference worker {os.getpid()} attached to {shm_name}")
+
+def _worker_reaper():
+    """Apply MODEL_IDLE_TIMEOUT_SECONDS and MODEL_RSS_BUDGET_MB to this worker's models"""
+    registry = get_registry()
+    while True:
+        time.sleep(MODEL_REAPER_INTERVAL_SECONDS)
+        registry.evict_idle()
+        registry.enforce_budget()
+
+def _worker_run(task: str, slot: int, shape, args: tuple):
+    from services import pipeline
+    from services.timing import collect
+    image = slot_view(_worker_shm, _worker_slot_bytes, slot, shape)
+    result, timings = collect(getattr(pipeline, task), image, *args)
+    # Piggyback this worker's registry state so the parent can report it
+    return result, timings, os.getpid(), get_registry().metrics()
+
+
+# --- event-loop process side ---
+
+class InferenceProcessPool:
+    """Runs services/pipeline.py tasks in worker processes fed through a SharedFrameRing"""
+
+    def __init__(self, workers: int = INFERENCE_WORKERS, slots: int = SHM_SLOTS,
+                 slot_bytes: int = int(SHM_SLOT_MB * 1024 * 1024)):
+        workers = workers or get_execution_plan().workers
+        self.workers = workers
+        self.ring = SharedFrameRing(slots or 2 * workers, slot_bytes)
+        self.restarts = 0
+        self._worker_registry: Dict[int, tuple] = {}  # pid -> (monotonic time, registry metrics)
+        self.executor = self._start_executor()
+        print(f"🏭 Inference process pool: {workers} workers, {self.ring.slots} x {slot_bytes / 1024 / 1024:.0f} MB slots")
+
+    def _start_executor(self) -> ProcessPoolExecutor:
+        # spawn: never fork a process that already holds torch/mediapipe threads
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_worker_init,
+            initargs=(self.ring.name, self.ring.slot_bytes),
+        )
+
+    def _restart(self, broken: ProcessPoolExecutor) -> None:
+        """Replace an executor left broken by a dead worker (once, however many requests saw it)"""
+        if self.executor is not broken:
+            return
+        print("⚠️ Inference worker died (OOM kill?); restarting the process pool")
+        broken.shutdown(wait=False, cancel_futures=True)
+        # New workers attach to the same ring; slots of the lost tasks were already released
+        self.executor = self._start_executor()
+        self.restarts += 1
+        self._worker_registry.clear()
+
+    def fits(self, image: np.ndarray) -> bool:
+        return image.nbytes <= self.ring.slot_bytes and image.dtype == np.uint8
+
+    async def run(self, task: str, image: np.ndarray, *args):
+        """
+        Copy the decoded frame into a free slot and run task on it in a worker
+
+        Raises BrokenProcessPool if a worker died while this task was queued
+        or running; the pool is rebuilt before the error reaches the caller.
+        """
+        slot = await self.ring.acquire()
+        executor = self.executor
+        try:
+            np.copyto(self.ring.view(slot, image.shape), image)
+            future = executor.submit(_worker_run, task, slot, image.shape, args)
+        except BaseException as e:
+            self.ring.release(slot)
+            if isinstance(e, BrokenProcessPool):
+                self._restart(executor)
+            raise
+        # Recycle the slot only once the worker is done with it, even if the
+        # awaiting request is cancelled first
+        loop = asyncio.get_running_loop()
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self.ring.release, slot))
+        try:
+            result, timings, pid, registry = await asyncio.wrap_future(future)
+        except BrokenProcessPool:
+            self._restart(executor)
+            raise
+        merge(timings)
+        self._worker_registry[pid] = (time.monotonic(), registry)
+        return result
+
+    def metrics(self) -> dict:
+        """Pool shape plus each worker's model registry as of its last completed task"""
+        now = time.monotonic()
+        return {
+            "workers": self.workers,
+            "slots": self.ring.slots,
+            "restarts": self.restarts,
+            "workerRegistry": {
+                str(pid): {**registry, "reportedSecondsAgo": round(now - at, 1)}
+                for pid, (at, registry) in self._worker_registry.items()
+            },
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.ring.close()
@@ -0,0 +1,283 @@
+import asyncio
+import bisect
+import hashlib
+import heapq
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import quote
+
+import httpx
+
+# Coordinator side of sharded identification: every shard is a regular
+# ml_service instance holding part of the gallery (see services/gallery.py).
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class ConsistentHashRing:
+    """Maps user IDs to shard URLs; adding/removing a shard only moves ~1/N keys"""
+
+    def __init__(self, nodes: Iterable[str] = (), replicas: int = 100):
+        self.replicas = replicas
+        self._keys: List[int] = []
+        self._owners: Dict[int, str] = {}
+        self._nodes: List[str] = []
+        for node in nodes:
+            self.add_node(node)
+
+    @property
+    def nodes(self) -> List[str]:
+        return list(self._nodes)
+
+    def add_node(self, node: str) -> None:
+        if node in self._nodes:
+            return
+        self._nodes.append(node)
+        for i in range(self.replicas):
+            point = _hash(f"{node}#{i}")
+            self._owners[point] = node
+            bisect.insort(self._keys, point)
+
+    def remove_node(self, node: str) -> None:
+        if node not in self._nodes:
+            return
+        self._nodes.remove(node)
+        for i in range(self.replicas):
+            point = _hash(f"{node}#{i}")
+            if self._owners.get(point) == node:
+                del self._owners[point]
+                self._keys.remove(point)
+
+    def get_node(self, key: str) -> Optional[str]:
+        if not self._keys:
+            return None
+        idx = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._owners[self._keys[idx]]
+
+
+class RebalanceLock:
+    """
+    Shared for single-user writes, exclusive for rebalancing
+
+    Writes run concurrently with each other and only exclude a rebalance.
+    A pending rebalance stops new writes from starting, so it cannot starve.
+    """
+
+    def __init__(self):
+        self._cond = asyncio.Condition()
+        self._writers = 0
+        self._rebalancing = False
+
+    @asynccontextmanager
+    async def shared(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: not self._rebalancing)
+            self._writers += 1
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self._writers -= 1
+                self._cond.notify_all()
+
+    @asynccontextmanager
+    async def exclusive(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: not self._rebalancing)
+            self._rebalancing = True
+            await self._cond.wait_for(lambda: self._writers == 0)
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self._rebalancing = False
+                self._cond.notify_all()
+
+
+class ShardCoordinator:
+    """Fans gallery operations out to shard instances and merges their results"""
+
+    def __init__(self, shard_urls: Iterable[str], timeout: float = 0.5, replicas: int = 100,
+                 allowlist: Iterable[str] = (), admin_token: str = "", rebalance_timeout: float = 60.0):
+        shard_urls = [url.rstrip("/") for url in shard_urls]
+        self.ring = ConsistentHashRing(shard_urls, replicas=replicas)
+        self.timeout = timeout
+        # Per bulk call while rebalancing; writes wait for the whole rebalance
+        self.rebalance_timeout = rebalance_timeout
+        # Shards that may be added at runtime; the configured ones always are
+        self.allowlist = set(shard_urls) | {url.rstrip("/") for url in allowlist}
+        # Shards require the admin token on their bulk gallery endpoints
+        headers = {"X-Admin-Token": admin_token} if admin_token else {}
+        self._client = httpx.AsyncClient(headers=headers)
+        self._rebalance_lock = RebalanceLock()
+
+    @property
+    def shards(self) -> List[str]:
+        return self.ring.nodes
+
+    async def close(self):
+        await self._client.aclose()
+
+    def _owner(self, user_id: str, ring: Optional[ConsistentHashRing] = None) -> str:
+        owner = (ring or self.ring).get_node(user_id)
+        if owner is None:
+            raise RuntimeError("No shards configured")
+        return owner
+
+    async def enroll(self, user_id: str, embedding: List[float]) -> str:
+        # Shared: a rebalance never copies a shard while a write to it is in flight
+        async with self._rebalance_lock.shared():
+            owner = self._owner(user_id)
+            response = await self._client.post(
+                f"{owner}/gallery/enroll",
+                json={"userId": user_id, "embedding": embedding},
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            return owner
+
+    async def remove(self, user_id: str) -> bool:
+        async with self._rebalance_lock.shared():
+            owner = self._owner(user_id)
+            response = await self._client.delete(
+                f"{owner}/gallery/{quote(user_id, safe='')}", timeout=self.timeout
+            )
+            response.raise_for_status()
+            return response.json().get("removed", False)
+
+    async def _query_shard(self, shard: str, embedding: List[float], top_k: int) -> List[dict]:
+        response = await self._client.post(
+            f"{shard}/gallery/identify",
+            json={"embedding": embedding, "topK": top_k},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.json()["matches"]
+
+    async def identify(self, embedding: List[float], top_k: int = 5) -> dict:
+        """
+        Scatter the query to every shard, gather per-shard top-k and merge
+
+        Shards that error or miss the per-shard timeout are reported in
+        failedShards and the merged result is marked partial.
+        """
+        shards = self.shards
+        results = await asyncio.gather(
+            *(asyncio.wait_for(self._query_shard(s, embedding, top_k), self.timeout) for s in shards),
+            return_exceptions=True,
+        )
+
+        best: Dict[str, float] = {}
+        failed = []
+        for shard, result in zip(shards, results):
+            if isinstance(result, BaseException):
+                print(f"⚠️ Shard {shard} failed: {type(result).__name__}")
+                failed.append(shard)
+                continue
+            for match in result:
+                # A user may briefly live on two shards mid-rebalance
+                user_id, score = match["userId"], match["similarity"]
+                if score > best.get(user_id, float("-inf")):
+                    best[user_id] = score
+
+        merged = heapq.nlargest(top_k, best.items(), key=lambda item: item[1])
+        return {
+            "matches": [{"userId": u, "similarity": s} for u, s in merged],
+            "partial": bool(failed),
+            "failedShards": failed,
+        }
+
+    async def _fetch_entries(self, shard: str) -> List[dict]:
+        response = await self._client.get(f"{shard}/gallery/entries", timeout=self.rebalance_timeout)
+        response.raise_for_status()
+        return response.json()["entries"]
+
+    async def _evict(self, shard: str, user_ids: List[str]) -> None:
+        response = await self._client.post(
+            f"{shard}/gallery/evict", json={"userIds": user_ids}, timeout=self.rebalance_timeout
+        )
+        response.raise_for_status()
+
+    async def _copy(self, source: str, entries: List[dict], ring: ConsistentHashRing,
+                    copied: Dict[str, List[str]]) -> List[str]:
+        """Import entries that `ring` assigns elsewhere into their new owners; returns their IDs"""
+        by_owner: Dict[str, List[dict]] = {}
+        for entry in entries:
+            owner = self._owner(entry["userId"], ring)
+            if owner != source:
+                by_owner.setdefault(owner, []).append(entry)
+
+        moved = []
+        for owner, batch in by_owner.items():
+            response = await self._client.post(
+                f"{owner}/gallery/import", json={"entries": batch}, timeout=self.rebalance_timeout
+            )
+            response.raise_for_status()
+            ids = [entry["userId"] for entry in batch]
+            copied.setdefault(owner, []).extend(ids)
+            moved.extend(ids)
+        return moved
+
+    async def _rollback(self, copied: Dict[str, List[str]]) -> None:
+        """Evict copies made by a rebalance that failed; the sources still hold every entry"""
+        for owner, user_ids in copied.items():
+            try:
+                await self._evict(owner, user_ids)
+            except httpx.HTTPError as e:
+                # Leftover copies are harmless: identify keeps the best score per user
+                print(f"⚠️ Could not roll back {len(user_ids)} copies on {owner}: {e}")
+
+    async def _rebalance(self, ring: ConsistentHashRing, sources: List[str]) -> int:
+        """
+        Move entries from sources to their owners in `ring`, then switch to it
+
+        Every copy is made before the ring changes or anything is evicted, so
+        a failure part way leaves the old ring and all of its entries intact.
+        """
+        copied: Dict[str, List[str]] = {}
+        moved: Dict[str, List[str]] = {}
+        try:
+            for source in sources:
+                moved[source] = await self._copy(source, await self._fetch_entries(source), ring, copied)
+        except Exception:
+            await self._rollback(copied)
+            raise
+
+        self.ring = ring
+        for source, user_ids in moved.items():
+            if not user_ids:
+                continue
+            try:
+                await self._evict(source, user_ids)
+            except httpx.HTTPError:
+                # Source being drained may already be gone; copies are in place
+                pass
+        return sum(len(user_ids) for user_ids in moved.values())
+
+    async def add_shard(self, url: str) -> int:
+        """Add a shard and migrate the keys it now owns; returns entries moved"""
+        url = url.rstrip("/")
+        if url not in self.allowlist:
+            raise ValueError(f"{url} is not in ML_SHARD_ALLOWLIST")
+        async with self._rebalance_lock.exclusive():
+            if url in self.shards:
+                return 0
+            ring = ConsistentHashRing(self.shards + [url], replicas=self.ring.replicas)
+            moved = await self._rebalance(ring, self.shards)
+            print(f"🔀 Added shard {url}, moved {moved} entries")
+            return moved
+
+    async def remove_shard(self, url: str) -> int:
+        """Drain a shard into the remaining ring and drop it; returns entries moved"""
+        url = url.rstrip("/")
+        async with self._rebalance_lock.exclusive():
+            if url not in self.shards:
+                return 0
+            if len(self.shards) == 1:
+                raise ValueError("Cannot remove the last shard")
+            ring = ConsistentHashRing([s for s in self.shards if s != url], replicas=self.ring.replicas)
+            moved = await self._rebalance(ring, [url])
+            print(f"🔀 Removed shard {url}, moved {moved} entries")
+            return moved
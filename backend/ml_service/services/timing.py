@@ -0,0 +1,145 @@
+import io
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+# Per-request stage timings, reported as a Server-Timing header. The request's
+# timings dict lives in a ContextVar, so stages recorded on the event loop and
+# in run_in_threadpool workers (which copy the context) land in the same dict.
+# Worker processes collect their own and send them back with the result.
+# Code running outside a request (batch jobs, scripts) records nothing.
+
+_timings: ContextVar[Optional[dict]] = ContextVar("server_timings", default=None)
+
+
+@contextmanager
+def stage(name: str):
+    """Add the duration of the block to the current request's `name` stage"""
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + (time.perf_counter() - start) * 1000.0
+
+
+def merge(timings: dict) -> None:
+    """Fold stage timings measured elsewhere (a worker process) into the current request"""
+    current = _timings.get()
+    if current is not None:
+        for name, ms in timings.items():
+            current[name] = current.get(name, 0.0) + ms
+
+
+def collect(fn: Callable, *args):
+    """Run fn(*args) with a fresh timings dict; returns (result, timings)"""
+    timings = {}
+    token = _timings.set(timings)
+    try:
+        return fn(*args), timings
+    finally:
+        _timings.reset(token)
+
+
+def format_server_timing(timings: dict) -> str:
+    return ", ".join(f"{name};dur={ms:.1f}" for name, ms in timings.items())
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware: give each HTTP request a timings dict and emit it as Server-Timing"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = {}
+        token = _timings.set(timings)
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                timings["total"] = (time.perf_counter() - start) * 1000.0
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", format_server_timing(timings).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _timings.reset(token)
+
+
+class RequestProfiler:
+    """
+    Samples the next N pipeline runs with cProfile and aggregates them
+
+    Idle cost is one attribute read per request. Only one run is profiled at
+    a time; runs that overlap a profiled one are simply not sampled.
+    """
+
+    def __init__(self):
+        self.remaining = 0
+        self.profiled = 0
+        self._stats = None  # pstats.Stats, imported with the first sample
+        self._busy = threading.Lock()
+        self._lock = threading.Lock()
+
+    def start(self, requests: int) -> None:
+        with self._lock:
+            self.remaining = requests
+            self.profiled = 0
+            self._stats = None
+
+    def wants_sample(self) -> bool:
+        return self.remaining > 0
+
+    def run(self, fn: Callable, *args):
+        """Call fn(*args), profiling it if a sample is still wanted"""
+        if self.remaining <= 0 or not self._busy.acquire(blocking=False):
+            return fn(*args)
+        import cProfile
+        import pstats
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(fn, *args)
+        finally:
+            self._busy.release()
+            with self._lock:
+                if self.remaining > 0:
+                    self.remaining -= 1
+                    self.profiled += 1
+                    if self._stats is None:
+                        self._stats = pstats.Stats(profile)
+                    else:
+                        self._stats.add(profile)
+
+    def report(self, sort: str = "cumulative", limit: int = 40) -> dict:
+        with self._lock:
+            text = ""
+            if self._stats is not None:
+                out = io.StringIO()
+                self._stats.stream = out
+                self._stats.sort_stats(sort).print_stats(limit)
+                text = out.getvalue()
+            return {
+                "active": self.remaining > 0,
+                "remaining": self.remaining,
+                "profiled": self.profiled,
+                "report": text,
+            }
+
+
+_profiler = RequestProfiler()
+
+def get_profiler() -> RequestProfiler:
+    return _profiler
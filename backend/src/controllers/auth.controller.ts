@@ -2,7 +2,7 @@ import { Request, Response } from 'express';
 import { User } from '../models/User.model';
 import { LoginAttempt } from '../models/LoginAttempt.model';
 import { Verification } from '../models/Verification.model';
-import faceRecognitionService from '../services/faceRecognition.service';
+import faceRecognitionService, { MlImageRejectedError, MlServiceBusyError } from '../services/faceRecognition.service';
 import jwt from 'jsonwebtoken';
 import logger from '../utils/logger';
 
@@ -121,7 +121,7 @@ export const verifyFace = async (req: Request, res: Response): Promise<void> =>
 
         // Step 12-13: Detect face and generate embedding via ML service
         logger.info('Generating face embedding...');
-        const embeddingResult = await faceRecognitionService.generateEmbedding(faceImage);
+        const embeddingResult = await faceRecognitionService.generateEmbedding(faceImage, { priority: 'login' });
 
         if (!embeddingResult || embeddingResult.quality < MIN_QUALITY_SCORE) {
             res.status(400).json({
@@ -250,6 +250,26 @@ export const verifyFace = async (req: Request, res: Response): Promise<void> =>
             similarity: bestSimilarity,
         });
     } catch (error: any) {
+        if (error instanceof MlImageRejectedError) {
+            // No usable face, or a blurry/dark/overexposed frame stopped by the quality gate
+            res.status(400).json({
+                success: false,
+                error: 'poor_image_quality',
+                message: error.reason,
+                retryAllowed: true,
+            });
+            return;
+        }
+        if (error instanceof MlServiceBusyError) {
+            res.set('Retry-After', String(error.retryAfterSeconds));
+            res.status(503).json({
+                success: false,
+                error: 'service_busy',
+                message: 'Face verification is busy, please retry shortly',
+                retryAllowed: true,
+            });
+            return;
+        }
         logger.error('Face verification error:', error);
         res.status(500).json({
             success: false,
@@ -301,9 +321,32 @@ export const register = async (req: Request, res: Response): Promise<void> => {
         if (faceImage) {
             try {
                 // Generate embedding if face image provided
-                const embeddingResult = await faceRecognitionService.generateEmbedding(faceImage);
+                const embeddingResult = await faceRecognitionService.generateEmbedding(faceImage, {
+                    priority: 'enrollment',
+                });
                 embedding = embeddingResult.embedding;
             } catch (error) {
+                if (error instanceof MlImageRejectedError) {
+                    // The user meant to enroll a face; ask for a better photo instead of dropping it
+                    res.status(400).json({
+                        success: false,
+                        error: 'poor_image_quality',
+                        message: error.reason,
+                        retryAllowed: true,
+                    });
+                    return;
+                }
+                if (error instanceof MlServiceBusyError) {
+                    // Shed by admission control: ask the client to retry rather than enroll without a face
+                    res.set('Retry-After', String(error.retryAfterSeconds));
+                    res.status(503).json({
+                        success: false,
+                        error: 'service_busy',
+                        message: 'Face enrollment is busy, please retry shortly',
+                        retryAllowed: true,
+                    });
+                    return;
+                }
                 logger.warn('Failed to generate embedding during registration, proceeding without face data', error);
                 // We allow registration without face if generation fails, or we could strict fail.
                 // Given the requirement, improved reliability is better so we fail if face was intended but failed?
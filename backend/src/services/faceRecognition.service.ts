@@ -2,6 +2,40 @@ import axios from 'axios';
 import logger from '../utils/logger';
 
 const ML_SERVICE_URL = process.env.ML_SERVICE_URL || 'http://localhost:8000';
+// 0 = no client timeout: cold FaceNet loads (first use after a deploy or an
+// idle unload) can take well over 10s while the weights download
+const ML_SERVICE_TIMEOUT_MS = parseInt(process.env.ML_SERVICE_TIMEOUT_MS || '0', 10);
+
+/**
+ * Admission class for ML service requests (highest priority first)
+ */
+export type MlPriority = 'login' | 'enrollment' | 'batch';
+
+export interface MlRequestOptions {
+    priority?: MlPriority;
+    timeoutMs?: number;
+}
+
+/**
+ * The ML service shed the request (429/503) instead of queueing it
+ */
+export class MlServiceBusyError extends Error {
+    constructor(public retryAfterSeconds: number) {
+        super('ML service is busy');
+        this.name = 'MlServiceBusyError';
+    }
+}
+
+/**
+ * The ML service rejected the image itself (400): no usable face, or the
+ * frame failed the quality gate. `reason` is the service's explanation.
+ */
+export class MlImageRejectedError extends Error {
+    constructor(public reason: string) {
+        super(reason);
+        this.name = 'MlImageRejectedError';
+    }
+}
 
 export interface FaceDetectionResult {
     faceDetected: boolean;
@@ -25,17 +59,54 @@ export interface FaceComparisonResult {
     confidence: 'high' | 'medium' | 'low';
 }
 
+/**
+ * Send the caller's priority and time budget so the ML service can drop
+ * work we will no longer wait for instead of running it
+ */
+const requestConfig = (options: MlRequestOptions = {}) => {
+    const timeoutMs = options.timeoutMs ?? ML_SERVICE_TIMEOUT_MS;
+    const headers: Record<string, string> = {
+        'X-Request-Priority': options.priority ?? 'enrollment',
+    };
+    if (timeoutMs > 0) {
+        headers['X-Request-Timeout-Ms'] = String(timeoutMs);
+    }
+    return { timeout: Math.max(timeoutMs, 0), headers };
+};
+
+const busyError = (error: any): MlServiceBusyError | null => {
+    const status = error?.response?.status;
+    if (status !== 429 && status !== 503) {
+        return null;
+    }
+    const retryAfter = parseInt(error.response.headers?.['retry-after'] || '1', 10);
+    return new MlServiceBusyError(Number.isNaN(retryAfter) ? 1 : retryAfter);
+};
+
+const imageRejectedError = (error: any): MlImageRejectedError | null => {
+    if (error?.response?.status !== 400) {
+        return null;
+    }
+    const detail = error.response.data?.detail;
+    return new MlImageRejectedError(typeof detail === 'string' ? detail : 'Face image rejected');
+};
+
 class FaceRecognitionService {
     /**
      * Detect face in image
      */
-    async detectFace(imageBase64: string): Promise<FaceDetectionResult> {
+    async detectFace(imageBase64: string, options?: MlRequestOptions): Promise<FaceDetectionResult> {
         try {
             const response = await axios.post(`${ML_SERVICE_URL}/detect-face`, {
                 image: imageBase64,
-            });
+            }, requestConfig(options));
             return response.data;
         } catch (error) {
+            const busy = busyError(error);
+            if (busy) {
+                logger.warn(`Face detection shed by ML service, retry after ${busy.retryAfterSeconds}s`);
+                throw busy;
+            }
             logger.error('Face detection failed:', error);
             throw new Error('Face detection service unavailable');
         }
@@ -44,13 +115,23 @@ class FaceRecognitionService {
     /**
      * Generate face embedding from image
      */
-    async generateEmbedding(imageBase64: string): Promise<FaceEmbeddingResult> {
+    async generateEmbedding(imageBase64: string, options?: MlRequestOptions): Promise<FaceEmbeddingResult> {
         try {
             const response = await axios.post(`${ML_SERVICE_URL}/generate-embedding`, {
                 image: imageBase64,
-            });
+            }, requestConfig(options));
             return response.data;
         } catch (error) {
+            const busy = busyError(error);
+            if (busy) {
+                logger.warn(`Embedding generation shed by ML service, retry after ${busy.retryAfterSeconds}s`);
+                throw busy;
+            }
+            const rejected = imageRejectedError(error);
+            if (rejected) {
+                logger.info(`Face image rejected by ML service: ${rejected.reason}`);
+                throw rejected;
+            }
             logger.error('Embedding generation failed:', error);
             throw new Error('Embedding generation service unavailable');
         }
@@ -2,10 +2,25 @@ import request from 'supertest';
 import app from '../index';
 import { User } from '../models/User.model';
 import mongoose from 'mongoose';
-import faceRecognitionService from '../services/faceRecognition.service';
+import faceRecognitionService, {
+    MlImageRejectedError,
+    MlServiceBusyError,
+} from '../services/faceRecognition.service';
 
-// Mock the ML service to avoid external dependencies
-jest.mock('../services/faceRecognition.service');
+// Mock the ML service to avoid external dependencies (the error classes stay real)
+jest.mock('../services/faceRecognition.service', () => {
+    const actual = jest.requireActual('../services/faceRecognition.service');
+    return {
+        __esModule: true,
+        ...actual,
+        default: {
+            detectFace: jest.fn(),
+            generateEmbedding: jest.fn(),
+            compareEmbeddings: jest.fn(),
+            cosineSimilarity: jest.fn(),
+        },
+    };
+});
 
 describe('FaceSecure Authentication API', () => {
     const mockFaceImage = 'data:image/jpeg;base64,/9j/4AAQSkZJRg...';
@@ -82,6 +97,43 @@ describe('FaceSecure Authentication API', () => {
             expect(res.status).toBe(400);
             expect(res.body.error).toBe('user_exists');
         });
+
+        it('should ask for a new photo when the face image is rejected', async () => {
+            (faceRecognitionService.generateEmbedding as jest.Mock).mockRejectedValue(
+                new MlImageRejectedError('Frame rejected by quality gate: blur')
+            );
+
+            const res = await request(app)
+                .post('/api/auth/register')
+                .send({
+                    name: 'Test User',
+                    email: 'blurry@example.com',
+                    password: 'password123',
+                    faceImage: mockFaceImage,
+                });
+
+            expect(res.status).toBe(400);
+            expect(res.body.error).toBe('poor_image_quality');
+            expect(await User.findOne({ email: 'blurry@example.com' })).toBeNull();
+        });
+
+        it('should return 503 with Retry-After when enrollment is shed', async () => {
+            (faceRecognitionService.generateEmbedding as jest.Mock).mockRejectedValue(new MlServiceBusyError(3));
+
+            const res = await request(app)
+                .post('/api/auth/register')
+                .send({
+                    name: 'Test User',
+                    email: 'busy@example.com',
+                    password: 'password123',
+                    faceImage: mockFaceImage,
+                });
+
+            expect(res.status).toBe(503);
+            expect(res.headers['retry-after']).toBe('3');
+            expect(res.body.error).toBe('service_busy');
+            expect(await User.findOne({ email: 'busy@example.com' })).toBeNull();
+        });
     });
 
     describe('POST /api/auth/verify-face', () => {
@@ -162,6 +214,42 @@ describe('FaceSecure Authentication API', () => {
             expect(res.body.requireMFA).toBe(true);
         });
 
+        it('should return poor_image_quality when the quality gate rejects the frame', async () => {
+            (faceRecognitionService.generateEmbedding as jest.Mock).mockRejectedValue(
+                new MlImageRejectedError('Frame rejected by quality gate: dark')
+            );
+
+            const res = await request(app)
+                .post('/api/auth/verify-face')
+                .send({
+                    faceImage: mockFaceImage,
+                    livenessData: mockLivenessData,
+                    metadata: mockMetadata,
+                });
+
+            expect(res.status).toBe(400);
+            expect(res.body.error).toBe('poor_image_quality');
+            expect(res.body.message).toContain('dark');
+            expect(res.body.retryAllowed).toBe(true);
+        });
+
+        it('should return 503 with Retry-After when the ML service sheds the request', async () => {
+            (faceRecognitionService.generateEmbedding as jest.Mock).mockRejectedValue(new MlServiceBusyError(7));
+
+            const res = await request(app)
+                .post('/api/auth/verify-face')
+                .send({
+                    faceImage: mockFaceImage,
+                    livenessData: mockLivenessData,
+                    metadata: mockMetadata,
+                });
+
+            expect(res.status).toBe(503);
+            expect(res.headers['retry-after']).toBe('7');
+            expect(res.body.error).toBe('service_busy');
+            expect(res.body.retryAllowed).toBe(true);
+        });
+
         it('should reject stale requests (timestamp check)', async () => {
             const staleMetadata = {
                 ...mockMetadata,